@@ -22,6 +22,45 @@
 #                            new pandas dataframe method.
 #               30/08/2022 - Add new method to return the database data as a
 #                            JSON formatted dictionary.
+#               17/10/2026 - Add a ConnectionPool class. Connections are now
+#                            reused between queries instead of being opened
+#                            and closed for every call.
+#               17/10/2026 - Add fetch() and execute() methods, which take the
+#                            query and values as arguments rather than via
+#                            the shared properties, so one SQLClass object
+#                            can be used safely by several threads at once.
+#               17/10/2026 - Add a 'native' option to fetch(), returning the
+#                            column names separately from a list of row
+#                            tuples holding the values as SQLite types.
+#               17/10/2026 - Add iterate() and iterTableData() generators, which
+#                            read the result set in batches with fetchmany()
+#                            rather than building the whole list in memory.
+#               17/10/2026 - Add a transaction() context manager, plus the
+#                            executeMany() and bulkInsert() methods, so that
+#                            many rows can be written with a single commit.
+#               17/10/2026 - Add named PRAGMA profiles (PROFILES), applied by
+#                            the connection pool to every new connection.
+#               17/10/2026 - Add a QueryStats class. Every statement run by
+#                            SQLClass is timed, and slow ones are logged
+#                            along with their EXPLAIN QUERY PLAN output.
+#               17/10/2026 - Add the migrate() method, applying versioned
+#                            schema changes tracked in PRAGMA user_version.
+#               17/10/2026 - Add dataVersion(), to tell whether the database
+#                            has changed since some data was cached.
+#               17/10/2026 - Add a SchemaCatalog class, holding the whole
+#                            schema in memory until PRAGMA schema_version
+#                            changes. The schema methods now read from it.
+#               17/10/2026 - Add getTablePage(), for paging through a table
+#                            with a keyset on its rowid or primary key, and
+#                            approxRowCount().
+#               17/10/2026 - Add fetchPage(), keyset paging for any query.
+#               17/10/2026 - Add a QueryCache class, an LRU cache of query
+#                            results used by fetch(cached=True). Writes drop
+#                            the entries for the tables they change, and
+#                            PRAGMA data_version catches other processes.
+#               17/10/2026 - Add execute()'s 'rowcount' option.
+#               17/10/2026 - getTablePage() ignores after/before keys that
+#                            don't match the table's key columns.
 #
 # *** NOTE ***
 # In order for this module to be availabe in any project (without needing to
@@ -43,8 +82,782 @@
 #
 #-------------------------------------------------------------------------------
 
+import atexit
 import os
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+#-------------------------------------------------------------------------------
+# Named sets of PRAGMA settings, applied to every new connection. The
+# busy_timeout value (milliseconds) is also used as the connect() timeout.
+#   default     - SQLite's own settings (rollback journal, no busy timeout).
+#   safe        - WAL journal, so readers and a writer don't block each other,
+#                 with a full fsync on every commit.
+#   performance - WAL journal, fsync only at checkpoints, 256Mb memory-mapped
+#                 I/O, a 32Mb page cache and temporary tables held in memory.
+#-------------------------------------------------------------------------------
+
+PROFILES = {
+    'default': {},
+    'safe': {'journal_mode': 'WAL', 'synchronous': 'FULL',
+             'busy_timeout': 5000},
+    'performance': {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                    'mmap_size': 268435456, 'cache_size': -32000,
+                    'temp_store': 'MEMORY', 'busy_timeout': 5000},
+}
+
+#-------------------------------------------------------------------------------
+
+class QueryStats:
+    """ Timing statistics for the statements run against a database, grouped
+    by query 'fingerprint' (the query text with literal values and parameter
+    lists reduced to '?', and whitespace/case normalised). Any statement that
+    takes longer than 'slowMs' milliseconds is also added to a slow query log,
+    with its query plan.
+    """
+
+    def __init__(self, slowMs=100.0, samples=500, slowLogSize=50):
+        """ 'samples' is the number of recent timings kept per fingerprint for
+            the percentile figures; 'slowLogSize' the number of slow queries
+            kept in the log. """
+
+        self.slowMs = slowMs
+        self.samples = samples
+        self.__stats = {}     # fingerprint : [calls, total, max, rows, deque]
+        self.__slowLog = deque(maxlen=slowLogSize)
+        self.__lock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+
+    @staticmethod
+    def fingerprint(query):
+        """ Return the normalised form of the query text. """
+
+        fp = re.sub(r"'(?:[^']|'')*'", '?', query)           # string literals
+        fp = re.sub(r'\b\d+(?:\.\d+)?\b', '?', fp)           # numbers
+        fp = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?+)', fp)   # value lists
+        fp = ' '.join(fp.split()).rstrip('; ')
+        return fp.lower()
+
+#-------------------------------------------------------------------------------
+
+    def isSlow(self, seconds):
+        """ True if a statement taking 'seconds' should go in the slow log. """
+
+        return seconds * 1000 >= self.slowMs
+
+#-------------------------------------------------------------------------------
+
+    def record(self, query, seconds, rows, plan=None):
+        """ Add the timing for one statement. If 'plan' is given (a list of
+            strings) the statement is also added to the slow query log. """
+
+        fp = self.fingerprint(query)
+        with self.__lock:
+            entry = self.__stats.get(fp)
+            if entry is None:
+                entry = [0, 0.0, 0.0, 0, deque(maxlen=self.samples)]
+                self.__stats[fp] = entry
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += rows
+            entry[4].append(seconds)
+            if plan is not None:
+                self.__slowLog.appendleft([
+                    datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+                    round(seconds * 1000, 2), ' '.join(query.split()), plan])
+
+#-------------------------------------------------------------------------------
+
+    def report(self):
+        """ Return a list of [fingerprint, calls, total ms, p50 ms, p95 ms,
+            max ms, rows], most expensive (by total time) first. """
+
+        with self.__lock:
+            entries = [(fp, e[0], e[1], e[2], e[3], sorted(e[4]))
+                       for fp, e in self.__stats.items()]
+
+        res = []
+        for fp, calls, total, most, rows, times in entries:
+            p50 = times[int(round(0.50 * (len(times) - 1)))]
+            p95 = times[int(round(0.95 * (len(times) - 1)))]
+            res.append([fp, calls, round(total * 1000, 2), round(p50 * 1000, 2),
+                        round(p95 * 1000, 2), round(most * 1000, 2), rows])
+        res.sort(key=lambda item: item[2], reverse=True)
+        return res
+
+#-------------------------------------------------------------------------------
+
+    def slowLog(self):
+        """ Return the slow query log, newest first, as a list of
+            [time, ms, query, [query plan lines]]. """
+
+        with self.__lock:
+            return list(self.__slowLog)
+
+#-------------------------------------------------------------------------------
+
+    def reset(self):
+        """ Clear all statistics and the slow query log. """
+
+        with self.__lock:
+            self.__stats.clear()
+            self.__slowLog.clear()
+
+#-------------------------------------------------------------------------------
+
+class QueryCache:
+    """ A bounded, least-recently-used cache of query results, keyed by the
+    query text and its values. Each entry records the tables that the query
+    reads, so a write only drops the entries for the tables that it changes.
+    A change of PRAGMA data_version that was not caused by a write through
+    this pool (i.e. another process wrote to the file) drops everything.
+    A maxSize of 0 turns the cache off.
+    """
+
+    def __init__(self, maxSize=256):
+
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0          # entries dropped to make room
+        self.invalidations = 0      # entries dropped as their data changed
+        self.flushes = 0            # whole cache dropped (other processes)
+        self.__entries = OrderedDict()  # key : (tables, result)
+        self.__byTable = {}         # lower-case table name : set of keys
+        self.__tables = {}          # query : (schema, tables read/written)
+        self.__version = None       # data_version after our last write
+        self.__generation = 0       # incremented by every invalidation
+        self.__lock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+
+    def get(self, key):
+        """ Return (True, result) for a cached key, or (False, generation) -
+            the generation is passed back to put(), so that a result read
+            while a write was dropping its tables is not stored. """
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, self.__generation
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+#-------------------------------------------------------------------------------
+
+    def put(self, key, tables, result, generation):
+        """ Store a result, read from the given tables, evicting the least
+            recently used entries if the cache is full. """
+
+        with self.__lock:
+            if generation != self.__generation or self.maxSize <= 0:
+                return
+            self.__drop(key)
+            self.__entries[key] = (tables, result)
+            for table in tables:
+                self.__byTable.setdefault(table, set()).add(key)
+            while len(self.__entries) > self.maxSize:
+                self.__drop(next(iter(self.__entries)))
+                self.evictions += 1
+
+#-------------------------------------------------------------------------------
+
+    def invalidate(self, tables=None):
+        """ Drop the entries that read any of the (lower-case) table names, or
+            every entry if tables is None. """
+
+        with self.__lock:
+            self.__generation += 1
+            if tables is None:
+                self.invalidations += len(self.__entries)
+                self.__entries.clear()
+                self.__byTable.clear()
+                return
+            for table in tables:
+                for key in list(self.__byTable.get(table, ())):
+                    self.__drop(key)
+                    self.invalidations += 1
+
+#-------------------------------------------------------------------------------
+
+    def checkVersion(self, version):
+        """ Drop everything if the data_version has changed since the last
+            write through this pool (noteVersion), i.e. some other process
+            has written to the database. """
+
+        with self.__lock:
+            if version == self.__version:
+                return
+            known, self.__version = self.__version, version
+        if known is not None:
+            self.invalidate()
+            self.flushes += 1
+
+#-------------------------------------------------------------------------------
+
+    def noteVersion(self, version):
+        """ Record the data_version after a write through this pool, whose
+            tables have already been invalidated. """
+
+        with self.__lock:
+            self.__version = version
+
+#-------------------------------------------------------------------------------
+
+    def tables(self, query, schema):
+        """ Return the remembered tables for a query, or None. 'schema' is the
+            SchemaCatalog dictionary they were worked out with. """
+
+        with self.__lock:
+            entry = self.__tables.get(query)
+        if entry is not None and entry[0] is schema:
+            return entry[1]
+        return None
+
+#-------------------------------------------------------------------------------
+
+    def setTables(self, query, schema, tables):
+        """ Remember the tables read or written by a query. """
+
+        with self.__lock:
+            if len(self.__tables) >= 4 * max(self.maxSize, 64):
+                self.__tables.clear()
+            self.__tables[query] = (schema, tables)
+
+#-------------------------------------------------------------------------------
+
+    def stats(self):
+        """ Return a dictionary with the cache counters. """
+
+        with self.__lock:
+            calls = self.hits + self.misses
+            return {'size': len(self.__entries), 'maxSize': self.maxSize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hitRate': round(100 * self.hits / calls, 1) if calls else 0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'flushes': self.flushes}
+
+#-------------------------------------------------------------------------------
+
+    def reset(self):
+        """ Empty the cache and zero the counters. """
+
+        self.invalidate()
+        with self.__lock:
+            self.hits = self.misses = self.evictions = 0
+            self.invalidations = self.flushes = 0
+
+#-------------------------------------------------------------------------------
+
+    def __drop(self, key):
+        """ Remove one entry (the lock must be held). """
+
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            return
+        for table in entry[0]:
+            keys = self.__byTable.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.__byTable[table]
+
+#-------------------------------------------------------------------------------
+
+class Column:
+    """ One column of a table or view, as given by PRAGMA table_info. """
+
+    __slots__ = ('cid', 'name', 'type', 'notnull', 'default', 'pk')
+
+    def __init__(self, cid, name, type, notnull, default, pk):
+        self.cid = cid
+        self.name = name
+        self.type = type
+        self.notnull = notnull
+        self.default = default
+        self.pk = pk
+
+#-------------------------------------------------------------------------------
+
+class SchemaObject:
+    """ A table, view, index or trigger from sqlite_master. For tables and
+    views, 'columns' is a tuple of Column objects; for tables, 'indexes' is a
+    tuple of the names of the indexes on the table.
+    """
+
+    __slots__ = ('type', 'name', 'table', 'sql', 'rootpage', 'columns',
+                 'indexes')
+
+    def __init__(self, type, name, table, sql, rootpage=0):
+        self.type = type
+        self.name = name
+        self.table = table
+        self.sql = sql
+        self.rootpage = rootpage
+        self.columns = ()
+        self.indexes = ()
+
+    @property
+    def hasRowid(self):
+        """ True for an ordinary table (not a view, or WITHOUT ROWID table). """
+
+        return (self.type == 'table' and
+                ' '.join((self.sql or '').lower().split()).find(
+                    'without rowid') < 0)
+
+    @property
+    def primaryKey(self):
+        """ The names of the declared primary key columns, in key order. """
+
+        cols = sorted((col for col in self.columns if col.pk),
+                      key=lambda col: col.pk)
+        return tuple(col.name for col in cols)
+
+#-------------------------------------------------------------------------------
+
+class SchemaCatalog:
+    """ An in-memory copy of the database schema: every table, view, index and
+    trigger, with the columns of the tables and views. It is read in a single
+    pass, and only read again when PRAGMA schema_version shows that the
+    schema has been changed (by any connection).
+    """
+
+    def __init__(self, pool):
+        """ 'pool' is the ConnectionPool for the database. """
+
+        self.__pool = pool
+        self.__version = None
+        self.__objects = {}         # lower-case name : SchemaObject
+        self.__lock = threading.Lock()
+        self.loads = 0              # number of times the schema has been read
+
+#-------------------------------------------------------------------------------
+
+    def objects(self):
+        """ Return the current {lower-case name: SchemaObject} dictionary. The
+            dictionary is replaced, never changed, when the schema is read
+            again, so callers may keep and use it without locking. """
+
+        with self.__pool.connection() as conn:
+            version = conn.execute('pragma schema_version;').fetchone()[0]
+            if version != self.__version:
+                with self.__lock:
+                    if version != self.__version:
+                        self.__objects = self.__load(conn)
+                        self.__version = version
+                        self.loads += 1
+        return self.__objects
+
+#-------------------------------------------------------------------------------
+
+    def get(self, name):
+        """ Return the SchemaObject with this name (in any case), or None. """
+
+        return self.objects().get(name.lower())
+
+#-------------------------------------------------------------------------------
+
+    def names(self, type):
+        """ Return the names of all objects of the given type ('table',
+            'view', 'index' or 'trigger'), sorted. """
+
+        return sorted(obj.name for obj in self.objects().values()
+                      if obj.type == type)
+
+#-------------------------------------------------------------------------------
+
+    def __load(self, conn):
+        """ Read the schema from sqlite_master, and the columns of every table
+            and view with the pragma_table_info table-valued function. """
+
+        objects = {}
+        query = 'Select type, name, tbl_name, sql, rootpage From sqlite_master;'
+        for type, name, table, sql, rootpage in conn.execute(query):
+            objects[name.lower()] = SchemaObject(type, name, table, sql,
+                                                 rootpage)
+
+        columns = {}
+        query = 'Select m.name, p.cid, p.name, p.type, p."notnull", '
+        query += 'p.dflt_value, p.pk From sqlite_master m, '
+        query += 'pragma_table_info(m.name) p '
+        query += "Where m.type In ('table', 'view') Order By m.name, p.cid;"
+        for row in conn.execute(query):
+            columns.setdefault(row[0].lower(), []).append(Column(*row[1:]))
+
+        indexes = {}
+        for obj in objects.values():
+            if obj.type == 'index':
+                indexes.setdefault(obj.table.lower(), []).append(obj.name)
+
+        for key, obj in objects.items():
+            obj.columns = tuple(columns.get(key, ()))
+            obj.indexes = tuple(sorted(indexes.get(key, ())))
+        return objects
+
+#-------------------------------------------------------------------------------
+
+class ConnectionPool:
+    """ A pool of reusable connections to a single SQLite database file. A
+    thread checks a connection out for the duration of a query and hands it
+    back afterwards, so the connect/teardown cost is only paid once per pooled
+    connection. Nested requests from the same thread are given the connection
+    that thread already holds. At most 'maxSize' connections are open at once;
+    further threads wait (up to 'timeout' seconds) for one to be returned.
+    """
+
+    def __init__(self, db, maxSize=5, timeout=30.0, checkInterval=60.0):
+        """ Create an empty pool - connections are only opened on demand. """
+
+        self.db = db
+        self.maxSize = maxSize
+        self.timeout = timeout              # seconds to wait for a connection
+        self.checkInterval = checkInterval  # idle seconds before a health check
+        self.profile = 'default'            # key in PROFILES
+        self.queryStats = QueryStats()      # timings for statements run
+        self.catalog = SchemaCatalog(self)  # in-memory copy of the schema
+        self.queryCache = QueryCache()      # results for fetch(cached=True)
+        self.__idle = []                    # [connection, time last returned]
+        self.__open = 0                     # connections currently in existence
+        self.__closed = False
+        self.__cond = threading.Condition()
+        self.__local = threading.local()
+        self.__watcher = None               # connection used by dataVersion()
+        self.__watchLock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+
+    @contextmanager
+    def connection(self):
+        """ Context manager providing a connection for the calling thread. The
+            connection is returned to the pool when the outermost 'with' block
+            for this thread exits. """
+
+        held = getattr(self.__local, 'conn', None)
+        if held is not None:
+            self.__local.depth += 1
+            try:
+                yield held
+            finally:
+                self.__local.depth -= 1
+            return
+
+        conn = self.__acquire()
+        self.__local.conn = conn
+        self.__local.depth = 1
+        try:
+            yield conn
+        finally:
+            self.__local.depth -= 1
+            if self.__local.depth == 0:
+                self.__local.conn = None
+                self.__release(conn)
+
+#-------------------------------------------------------------------------------
+
+    @contextmanager
+    def transaction(self):
+        """ Context manager running everything the calling thread does on this
+            pool inside a single transaction. It commits when the outermost
+            'with' block exits normally, and rolls back if it exits with an
+            exception. Nested blocks join the outer transaction. """
+
+        with self.connection() as conn:
+            if self.inTransaction():
+                self.__local.txDepth += 1
+                try:
+                    yield conn
+                finally:
+                    self.__local.txDepth -= 1
+                return
+
+            conn.execute('Begin Immediate;')
+            self.__local.txDepth = 1
+            self.__local.txTables = set()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                self.__local.txDepth = 0
+                # Readers may have cached the old data since the writes were
+                # made, so drop the tables again now the transaction is over.
+                tables, self.__local.txTables = self.__local.txTables, set()
+                if tables:
+                    self.__wroteTables(None if None in tables else tables)
+
+#-------------------------------------------------------------------------------
+
+    def inTransaction(self):
+        """ Return True if the calling thread is inside a transaction() block. """
+
+        return getattr(self.__local, 'txDepth', 0) > 0
+
+#-------------------------------------------------------------------------------
+
+    def wrote(self, tables=None):
+        """ Tell the query cache that the calling thread has written to these
+            (lower-case) tables - None for any table, or the schema. Inside a
+            transaction they are dropped again when it ends. """
+
+        self.queryCache.invalidate(tables)
+        if self.inTransaction():
+            self.__local.txTables.update(tables if tables else [None])
+        else:
+            self.__wroteTables(tables)
+
+#-------------------------------------------------------------------------------
+
+    def setProfile(self, profile):
+        """ Select the PRAGMA profile (a key in PROFILES) for the connections.
+            Idle connections are closed, so that every connection handed out
+            from now on has the new settings. """
+
+        if profile not in PROFILES:
+            raise ValueError(f'Unknown database profile : {profile}')
+
+        with self.__cond:
+            if profile == self.profile:
+                return
+            self.profile = profile
+            idle, self.__idle = self.__idle, []
+            self.__open -= len(idle)
+            self.__cond.notify_all()
+
+        for conn, _ in idle:
+            self.__discard(conn)
+
+#-------------------------------------------------------------------------------
+
+    def dataVersion(self):
+        """ Return PRAGMA data_version as seen by a connection kept for just
+            this purpose. Its value changes whenever any other connection -
+            a pooled one, or one in another process - commits a change to
+            the database, so it tells callers whether cached data is stale. """
+
+        with self.__watchLock:
+            if self.__closed:
+                raise sqlite3.ProgrammingError('Connection pool is closed')
+            if self.__watcher is None:
+                self.__watcher = self.__connect()
+            return self.__watcher.execute('pragma data_version;').fetchone()[0]
+
+#-------------------------------------------------------------------------------
+
+    def stats(self):
+        """ Return a dictionary with the current pool usage. """
+
+        with self.__cond:
+            return {'database': self.db, 'profile': self.profile,
+                    'maxSize': self.maxSize, 'open': self.__open,
+                    'idle': len(self.__idle), 'closed': self.__closed}
+
+#-------------------------------------------------------------------------------
+
+    def close(self):
+        """ Close all idle connections and refuse any further requests.
+            Connections still checked out are closed as they are returned. """
+
+        with self.__cond:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+            self.__open -= len(idle)
+            self.__cond.notify_all()
+
+        for conn, _ in idle:
+            self.__discard(conn)
+
+        with self.__watchLock:
+            if self.__watcher is not None:
+                self.__discard(self.__watcher)
+                self.__watcher = None
+
+#-------------------------------------------------------------------------------
+
+    def __acquire(self):
+        """ Take an idle connection (health checking it if it has been unused
+            for a while), open a new one if below maxSize, or wait. """
+
+        deadline = time.monotonic() + self.timeout
+        with self.__cond:
+            while True:
+                if self.__closed:
+                    raise sqlite3.ProgrammingError('Connection pool is closed')
+                if self.__idle:
+                    conn, lastUsed = self.__idle.pop()
+                    break
+                if self.__open < self.maxSize:
+                    self.__open += 1
+                    conn, lastUsed = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f'No free connection after {self.timeout} seconds')
+                self.__cond.wait(remaining)
+
+        # Connect or health check outside the lock, so other threads can
+        # carry on using the pool meanwhile.
+        try:
+            if conn is not None and \
+                    time.monotonic() - lastUsed > self.checkInterval:
+                if not self.__healthy(conn):
+                    self.__discard(conn)
+                    conn = None
+            if conn is None:
+                conn = self.__connect()
+        except Exception:
+            with self.__cond:
+                self.__open -= 1
+                self.__cond.notify()
+            raise
+
+        return conn
+
+#-------------------------------------------------------------------------------
+
+    def __release(self, conn):
+        """ Hand a connection back to the pool, rolling back anything left
+            uncommitted so the next user starts with a clean connection. """
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            usable = True
+        except sqlite3.Error:
+            usable = False
+
+        with self.__cond:
+            if usable and not self.__closed:
+                self.__idle.append([conn, time.monotonic()])
+                conn = None
+            else:
+                self.__open -= 1
+            self.__cond.notify()
+
+        if conn is not None:
+            self.__discard(conn)
+
+#-------------------------------------------------------------------------------
+
+    def __wroteTables(self, tables):
+        """ After a committed write, drop the tables from the query cache and
+            note the data_version that it has brought the database to. """
+
+        self.queryCache.invalidate(tables)
+        try:
+            self.queryCache.noteVersion(self.dataVersion())
+        except sqlite3.Error:
+            self.queryCache.invalidate()
+
+#-------------------------------------------------------------------------------
+
+    def __connect(self):
+        """ Open a new connection and apply the PRAGMA profile to it. It may be
+            handed to a different thread on each checkout, but only ever to one
+            thread at a time. """
+
+        pragmas = PROFILES[self.profile]
+        timeout = pragmas.get('busy_timeout', 5000) / 1000
+        conn = sqlite3.connect(self.db, timeout=timeout,
+                               check_same_thread=False)
+        try:
+            for name, value in pragmas.items():
+                conn.execute(f'pragma {name} = {value};').fetchall()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+#-------------------------------------------------------------------------------
+
+    def __healthy(self, conn):
+        """ Check that a pooled connection is still usable. """
+
+        try:
+            conn.execute('Select 1;').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+#-------------------------------------------------------------------------------
+
+    def __discard(self, conn):
+        """ Close a connection, ignoring any error in doing so. """
+
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+#-------------------------------------------------------------------------------
+
+def quoteName(name):
+    """ Return a table or column name quoted for use as an SQL identifier. """
+
+    return '"' + name.replace('"', '""') + '"'
+
+def isKey(key, count):
+    """ Return True if 'key' can be used as a fetchPage key for 'count' key
+        columns - a list of that many strings, numbers or None. """
+
+    return (isinstance(key, list) and len(key) == count and
+            all(value is None or isinstance(value, (str, int, float))
+                for value in key))
+
+#-------------------------------------------------------------------------------
+
+def copyResult(result):
+    """ Return a copy of a fetch() result that can be changed without changing
+        the original - a list of lists, or a (columns, rows) tuple. """
+
+    if isinstance(result, tuple):
+        return result[0], list(result[1])
+    return [list(row) for row in result]
+
+#-------------------------------------------------------------------------------
+# Pools are shared by every SQLClass object using the same database file.
+#-------------------------------------------------------------------------------
+
+_pools = {}
+_poolsLock = threading.Lock()
+
+def getPool(db, maxSize=5):
+    """ Return the connection pool for the database file 'db', creating it
+        on first use. """
+
+    with _poolsLock:
+        pool = _pools.get(db)
+        if pool is None:
+            pool = ConnectionPool(db, maxSize)
+            _pools[db] = pool
+        return pool
+
+#-------------------------------------------------------------------------------
+
+def closePools():
+    """ Close every connection pool. Registered to run at interpreter exit. """
+
+    with _poolsLock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
+
+atexit.register(closePools)
 
 #-------------------------------------------------------------------------------
 
@@ -60,6 +873,8 @@ class SQLClass:
         self.__query = ''       # Input Property
         self.__values = ()      #   "      "
         self.__db = ''          #   "      "
+        self.__poolSize = 5     #   "      "
+        self.__profile = 'default'  #   "      "
         self.__results = ''     # Output property
 
 #-------------------------------------------------------------------------------
@@ -92,10 +907,54 @@ class SQLClass:
     def db(self, value):
         self.__db = value
 
+    @property
+    def poolSize(self):
+        return self.__poolSize
+
+    @poolSize.setter
+    def poolSize(self, value):
+        self.__poolSize = value
+        getPool(self.db, value).maxSize = value
+
+    @property
+    def profile(self):
+        return self.__profile
+
+    @profile.setter
+    def profile(self, value):
+        getPool(self.db, self.poolSize).setProfile(value)
+        self.__profile = value
+
+    @property
+    def slowQueryMs(self):
+        return self.pool.queryStats.slowMs
+
+    @slowQueryMs.setter
+    def slowQueryMs(self, value):
+        self.pool.queryStats.slowMs = value
+
+    @property
+    def cacheSize(self):
+        return self.pool.queryCache.maxSize
+
+    @cacheSize.setter
+    def cacheSize(self, value):
+        self.pool.queryCache.maxSize = value
+        if not value:
+            self.pool.queryCache.invalidate()
+
     @property
     def results(self):
         return self.__results
 
+    @property
+    def pool(self):
+        return getPool(self.db, self.poolSize)
+
+    @property
+    def catalog(self):
+        return self.pool.catalog
+
 #-------------------------------------------------------------------------------
 # PUBLIC CLASS METHODS
 #-------------------------------------------------------------------------------
@@ -104,7 +963,7 @@ class SQLClass:
         """ Using the properties passed in to the class, connect to the
         appropriate database and return the requested dataset. """
 
-        retDataset = self.__GetSQLiteData()
+        retDataset = self.__GetSQLiteData(self.query, self.values)
         return retDataset
 
 #-------------------------------------------------------------------------------
@@ -112,60 +971,236 @@ class SQLClass:
     def UpdateSQLData(self):
         """ Update the database. """
 
-        return self.__UpdateSQLiteData()
+        return self.__UpdateSQLiteData(self.query, self.values)
+
+#-------------------------------------------------------------------------------
+
+    def fetch(self, query, values=(), native=False, cached=False):
+        """ Run a parameterised select query and return the dataset, in the
+            same format as GetSQLData. Nothing is stored on the object, so
+            this is safe to call from several threads at once.
+            If 'native' is True, return a tuple (columns, rows) instead, where
+            columns is a tuple of the column names and rows is a list of
+            tuples with the values left as returned by SQLite (int, float,
+            str, bytes or None). No header row, and no conversion to str.
+            If 'cached' is True, the result may come from the pool's
+            QueryCache, and is stored there if not - until one of the tables
+            it reads is written to. """
+
+        if cached and self.pool.queryCache.maxSize > 0:
+            return self.__cachedFetch(query, values, native)
+        return self.__GetSQLiteData(query, values, native)
+
+#-------------------------------------------------------------------------------
+
+    def execute(self, query, values=(), rowcount=False):
+        """ Run a parameterised insert/update/delete query and return the
+            same result as UpdateSQLData - or, if 'rowcount' is True, the
+            number of rows changed. Nothing is stored on the object, so this
+            is safe to call from several threads at once. """
+
+        return self.__UpdateSQLiteData(query, values, rowcount=rowcount)
+
+#-------------------------------------------------------------------------------
+
+    def getSettings(self):
+        """ Return the PRAGMA settings actually in force on a pooled connection,
+            as a list of [name, value] pairs. """
+
+        names = ['journal_mode', 'synchronous', 'mmap_size', 'cache_size',
+                 'temp_store', 'busy_timeout']
+        settings = []
+        with self.pool.connection() as conn:
+            for name in names:
+                value = conn.execute(f'pragma {name};').fetchone()
+                settings.append([name, str(value[0]) if value else ''])
+        return settings
+
+#-------------------------------------------------------------------------------
+
+    def dataVersion(self):
+        """ Return a number that changes whenever the database is changed by
+            any connection, in this process or another. Cached query results
+            are still valid for as long as it stays the same. """
+
+        try:
+            return self.pool.dataVersion()
+        except Exception as err:
+            return '**ERROR**\ndataVersion : ' + str(err)
+
+#-------------------------------------------------------------------------------
+
+    def getSchemaVersion(self):
+        """ Return the schema version (PRAGMA user_version) of the database. """
+
+        with self.pool.connection() as conn:
+            return conn.execute('pragma user_version;').fetchone()[0]
+
+#-------------------------------------------------------------------------------
+
+    def migrate(self, migrations):
+        """ Bring the database schema up to date. 'migrations' is a list of
+            (version, description, steps) tuples, where each step is either an
+            SQL statement or a function taking the connection as its only
+            argument. Every migration with a version above the database's
+            PRAGMA user_version is applied, in version order, each in its own
+            transaction which also sets user_version to its version. Errors
+            are raised (the migration is rolled back), not returned.
+            Returns a list of the versions applied. """
+
+        applied = []
+        for version, desc, steps in sorted(migrations, key=lambda m: m[0]):
+            if version <= self.getSchemaVersion():
+                continue
+
+            with self.pool.transaction() as conn:
+                # Check again now that we hold the write lock, in case another
+                # process has just applied this migration.
+                if conn.execute('pragma user_version;').fetchone()[0] >= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f'pragma user_version = {int(version)};')
+            applied.append(version)
+
+        if applied:
+            self.pool.wrote(None)
+        return applied
+
+#-------------------------------------------------------------------------------
+
+    def executeMany(self, query, valueList):
+        """ Run a parameterised insert/update/delete query once for each tuple
+            of values in 'valueList', using a single executemany() call and a
+            single commit. Return the number of rows affected, or the error
+            message. """
+
+        return self.__UpdateSQLiteData(query, valueList, many=True)
+
+#-------------------------------------------------------------------------------
+
+    def bulkInsert(self, table, columns, rows, conflict=None):
+        """ Insert all of 'rows' (tuples of values, in the order of 'columns')
+            into 'table' with executeMany(). If 'conflict' is a list of key
+            columns (with a unique index on them), rows whose key already
+            exists update the other columns instead - i.e. an upsert. """
+
+        query = f'Insert Into {table} ({", ".join(columns)}) '
+        query += f'Values ({", ".join("?" * len(columns))})'
+        if conflict:
+            updates = [col for col in columns if col not in conflict]
+            query += f' On Conflict ({", ".join(conflict)}) Do '
+            if updates:
+                query += 'Update Set '
+                query += ', '.join(f'{col} = excluded.{col}' for col in updates)
+            else:
+                query += 'Nothing'
+        query += ';'
+        return self.executeMany(query, rows)
+
+#-------------------------------------------------------------------------------
+
+    @contextmanager
+    def transaction(self):
+        """ Context manager grouping several execute()/executeMany() calls
+            into one transaction, with one commit at the end, or a rollback if
+            the block raises an exception. Inside the block the write methods
+            raise errors rather than returning the error message, so that a
+            failure cannot be committed by mistake.
+            Usage : with sql.transaction():
+                        sql.execute(query1, values1)
+                        sql.execute(query2, values2)
+        """
+
+        with self.pool.transaction():
+            yield self
+
+#-------------------------------------------------------------------------------
+
+    def iterate(self, query, values=(), batchSize=500, native=False):
+        """ Generator version of fetch() for large result sets. The first item
+            yielded is the list of column names, followed by one item per
+            record, read from the cursor 'batchSize' rows at a time. Records
+            are lists of strings (as GetSQLData), or the raw SQLite tuples if
+            'native' is True. Errors are raised rather than returned.
+            The connection is held until the generator is exhausted or closed
+            (a 'for' loop that breaks early, or garbage collection, closes
+            it), so it should be consumed by the thread that created it. """
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Only the time spent in SQLite is recorded, not the time that the
+            # caller spends between rows.
+            count, elapsed = 0, 0.0
+            try:
+                start = time.perf_counter()
+                cursor.execute(query, values)
+                elapsed += time.perf_counter() - start
+                colnames = [col[0] for col in cursor.description]
+                yield colnames
+                while True:
+                    start = time.perf_counter()
+                    rows = cursor.fetchmany(batchSize)
+                    elapsed += time.perf_counter() - start
+                    if not rows:
+                        break
+                    count += len(rows)
+                    for row in rows:
+                        if native:
+                            yield row
+                        else:
+                            yield [str(col) for col in row]
+                self.__record(conn, query, values, elapsed, count)
+            finally:
+                cursor.close()
 
 #-------------------------------------------------------------------------------
 
     def getTables(self):
-        """ Return a list of tables from the requested database. """
+        """ Return a list of tables from the requested database. Like the
+            other schema methods, this is answered from the schema catalog. """
 
-        query = "Select tbl_name From sqlite_master Where type = ? "
-        query += "Order By tbl_name;"
-        self.query = query
-        self.values = ('table',)
-        return self.__GetSQLiteData()
+        return [['tbl_name']] + [[name] for name in self.catalog.names('table')]
 
 #-------------------------------------------------------------------------------
 
     def getViews(self):
         """ Return a list of views from the requested database. """
 
-        query = "Select tbl_name From sqlite_master Where type = ? "
-        query += "Order By tbl_name;"
-        self.query = query
-        self.values = ('view',)
-        return self.__GetSQLiteData()
+        return [['tbl_name']] + [[name] for name in self.catalog.names('view')]
 
 #-------------------------------------------------------------------------------
 
     def getColumnList(self, table):
         """ Return a list of the column names for the requested table. The data
             types will be needed as well, to decide which values should be
-            enclosed in quotes and which not. """
+            enclosed in quotes and which not. The layout is the same as the
+            output of PRAGMA table_info. """
 
-        self.query = f'pragma table_info({table});'
-        self.values = tuple()
-        return self.__GetSQLiteData()
+        ret = [['cid', 'name', 'type', 'notnull', 'dflt_value', 'pk']]
+        obj = self.catalog.get(table)
+        if obj is not None:
+            for col in obj.columns:
+                ret.append([str(col.cid), col.name, col.type, str(col.notnull),
+                            str(col.default), str(col.pk)])
+        return ret
 
 #-------------------------------------------------------------------------------
 
     def getViewDefinition(self, view):
         """ Get the SQL definition of the requested database view. """
 
-        query = "Select sql From sqlite_master Where type = ? And tbl_name = ?;"
-        self.query = query
-        self.values = ('view',view)
-        return self.__GetSQLiteData()
+        return self.__getDefinition(view, 'view')
 
 #-------------------------------------------------------------------------------
 
     def getTableDefinition(self, table):
         """ Get the SQL definition of the requested database table. """
 
-        query = "Select sql From sqlite_master Where type = ? And tbl_name = ?;"
-        self.query = query
-        self.values = ('table',table)
-        return self.__GetSQLiteData()
+        return self.__getDefinition(table, 'table')
 
 #-------------------------------------------------------------------------------
 
@@ -176,9 +1211,166 @@ class SQLClass:
         query = "Select * From " + table
         if recs > 0: query += " Limit " + str(recs) + ";"
         else: query += ";"
-        self.query = query
-        self.values = ()
-        return self.__GetSQLiteData()
+        return self.fetch(query)
+
+#-------------------------------------------------------------------------------
+
+    def getTablePage(self, table, pageSize=15, after=None, before=None,
+                     start=None, last=False):
+        """ Return one page of rows from a table or view, for browsing. Tables
+            are paged with a keyset on their rowid (or on the primary key, for
+            a WITHOUT ROWID table), so every page costs the same to read as
+            the first one. A key is a list of the key column values.
+                after  - key of the last row of the current page (next page)
+                before - key of the first row of the current page (prev. page)
+                start  - a value to jump to : the page starting at the first
+                         row whose (first) key column is >= start
+                last   - True for the last page
+            With none of these, the first page is returned.
+            Views have no key, so they are paged by row position (Limit and
+            Offset), with the key being [row number].
+            Returns a dictionary with 'rows' (column names first, as
+            GetSQLData), 'first' and 'last' (keys of the first and last rows),
+            'prev' and 'next' (True if there are rows before/after the page)
+            and 'keyed' (False for a view) - or the error message. """
+
+        obj = self.catalog.get(table)
+        if obj is None or obj.type not in ('table', 'view'):
+            return '**ERROR**\ngetTablePage : no such table : ' + table
+        if obj.type == 'view':
+            return self.__offsetPage(obj, pageSize, after, before, start, last)
+
+        keys = ['rowid'] if obj.hasRowid else [quoteName(col) for col in
+                                               obj.primaryKey]
+        # A key that doesn't fit the table (e.g. an edited url) - first page
+        if after is not None and not isKey(after, len(keys)):
+            after = None
+        if before is not None and not isKey(before, len(keys)):
+            before = None
+        page = self.fetchPage('*', quoteName(obj.name), keys, '', (), pageSize,
+                              after, before, None if start is None else [start],
+                              last)
+        if isinstance(page, str):
+            return page
+        page['rows'].insert(0, page.pop('columns'))
+        page['keyed'] = True
+        return page
+
+#-------------------------------------------------------------------------------
+
+    def fetchPage(self, columns, source, keys, where='', values=(), pageSize=15,
+                  after=None, before=None, start=None, last=False,
+                  group=False, cached=False):
+        """ Return one page of a query, using a keyset : the page is found by
+            comparing the key columns with the key of the row it starts or
+            ends at, so any page costs the same to read as the first one (with
+            an index on the keys). The query run is
+                Select <keys>, <columns> From <source> Where <where>
+                    [Group By <keys>] Order By <keys> Limit <pageSize>
+            with 'values' for the '?' in 'where'. The keys must be unique. A
+            key is a list of the key column values.
+                after  - key of the last row of the current page (next page)
+                before - key of the first row of the current page (prev. page)
+                start  - the page starting at the first row with a key >= start
+                         (which may give just the first few key columns)
+                last   - True for the last page
+            With none of these, the first page is returned.
+            Returns a dictionary with 'columns' (the column names, without the
+            keys), 'rows' (lists of strings), 'first' and 'last' (the keys of
+            the first and last rows), and 'prev' and 'next' (True if there are
+            rows before/after this page) - or the error message.
+            'cached' is passed on to fetch(). """
+
+        keyList = ', '.join(keys)
+        base = list(values)
+        conds = [f'({where})'] if where else []
+        order = 'Asc'
+        # The extra bound on the first key lets SQLite seek an index on an
+        # expression, which it does not do for the row value comparison.
+        if after is not None:
+            conds.append(f'{keys[0]} >= ?')
+            conds.append(f'({keyList}) > ({", ".join("?" * len(keys))})')
+            values = base + [after[0]] + list(after)
+        elif before is not None:
+            conds.append(f'{keys[0]} <= ?')
+            conds.append(f'({keyList}) < ({", ".join("?" * len(keys))})')
+            values = base + [before[0]] + list(before)
+            order = 'Desc'
+        elif start is not None:
+            conds.append(f'({", ".join(keys[:len(start)])}) >= '
+                         f'({", ".join("?" * len(start))})')
+            values = base + list(start)
+        elif last:
+            order = 'Desc'
+
+        query = f'Select {keyList}, {columns} From {source} '
+        if conds:
+            query += 'Where ' + ' And '.join(conds) + ' '
+        if group:
+            query += f'Group By {keyList} '
+        query += 'Order By ' + ', '.join(f'{key} {order}' for key in keys)
+        query += ' Limit ?;'
+
+        ret = self.fetch(query, list(values) + [pageSize + 1], native=True,
+                         cached=cached)
+        if isinstance(ret, str):
+            return ret
+        cols, rows = ret
+
+        # One extra row was read, to find out if there is more that way
+        more = len(rows) > pageSize
+        rows = rows[:pageSize]
+        if order == 'Desc':
+            rows.reverse()
+
+        count = len(keys)
+        page = {'columns': list(cols[count:]), 'rows': [], 'first': None,
+                'last': None, 'prev': False, 'next': False}
+        if not rows:
+            return page
+        page['rows'] = [[str(col) for col in row[count:]] for row in rows]
+        page['first'] = list(rows[0][:count])
+        page['last'] = list(rows[-1][:count])
+
+        # The other direction only needs a single-row probe of the index
+        def probe(op, keyValues):
+            query = f'Select 1 From {source} Where '
+            query += f'({where}) And ' if where else ''
+            query += f'({keyList}) {op} ({", ".join("?" * count)}) Limit 1;'
+            ret = self.fetch(query, base + keyValues, native=True,
+                             cached=cached)
+            return not isinstance(ret, str) and bool(ret[1])
+
+        if order == 'Asc':
+            page['next'] = more
+            if after is not None or start is not None:
+                page['prev'] = probe('<', page['first'])
+        else:
+            page['prev'] = more
+            if before is not None:
+                page['next'] = probe('>', page['last'])
+        return page
+
+#-------------------------------------------------------------------------------
+
+    def approxRowCount(self, table):
+        """ Return the row count for a table recorded by the last ANALYZE (in
+            sqlite_stat1), without reading the table. None if not analysed. """
+
+        query = 'Select stat From sqlite_stat1 Where tbl = ? Limit 1;'
+        ret = self.fetch(query, [table], native=True)
+        if isinstance(ret, str) or not ret[1]:
+            return None
+        return int(ret[1][0][0].split()[0])
+
+#-------------------------------------------------------------------------------
+
+    def iterTableData(self, table, batchSize=500, native=False):
+        """ Generator returning every record from the requested table or view,
+            in the same form as iterate(). """
+
+        query = 'Select * From ' + quoteName(table) + ';'
+        return self.iterate(query, (), batchSize, native)
 
 #-------------------------------------------------------------------------------
 # PRIVATE CLASS METHODS
@@ -206,50 +1398,254 @@ class SQLClass:
 
 #-------------------------------------------------------------------------------
 
-    def __GetSQLiteData(self):
+    def __GetSQLiteData(self, query, values, native=False):
         """ Retrieve the requested data from the SQLite database file. Return
             either the requested dataset or the generated error message. The
             query is parameterised (i.e. actual values replaced by question
-            marks), with the values passed in a separate tuple, 'values'   """
+            marks), with the values passed in a separate tuple, 'values'. The
+            connection comes from (and goes back to) the connection pool. """
 
         try:
-            conn = sqlite3.connect(self.db)
-            cursor = conn.cursor()
-            cursor.execute(self.query, self.values)
-            return self.__FormatOutput(cursor)
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    start = time.perf_counter()
+                    cursor.execute(query, values)
+                    if native:
+                        ret = self.__NativeOutput(cursor)
+                        rows = len(ret[1])
+                    else:
+                        ret = self.__FormatOutput(cursor)
+                        rows = len(ret) - 1
+                    self.__record(conn, query, values,
+                                  time.perf_counter() - start, rows)
+                    return ret
+                finally:
+                    cursor.close()
         except Exception as err:
             return '**ERROR**\n__GetSQLiteData : ' + str(err)
-        finally:
-            try:
-                cursor.close()
-                del cursor
-                conn.close()
-            except:
-                pass
 
 #-------------------------------------------------------------------------------
 
-    def __UpdateSQLiteData(self):
+    def __UpdateSQLiteData(self, query, values, many=False, rowcount=False):
         """ Update the SQLite database. Return either the count of recods
             updated for success, or the generated error message. The query is
             parameterised (i.e. actual values replaced by question marks), with
-            the values passed in a separate tuple, 'values' """
+            the values passed in a separate tuple, 'values'. If 'many' is True,
+            'values' is a list of tuples and the row count is returned (as it
+            is if 'rowcount' is True), otherwise the last rowid.
+            Inside a transaction() block there is no commit here, and errors
+            are raised so that the transaction is rolled back. """
 
+        pool = self.pool
         try:
-            conn = sqlite3.connect(self.db)
-            cursor = conn.cursor()
-            cursor.execute(self.query, self.values)
-            conn.commit()
-            return cursor.lastrowid
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    start = time.perf_counter()
+                    if many:
+                        cursor.executemany(query, values)
+                    else:
+                        cursor.execute(query, values)
+                    if not pool.inTransaction():
+                        conn.commit()
+                    if many:
+                        values = values[0] if values else ()
+                    pool.wrote(self.__tablesUsed(conn, query, values, True))
+                    self.__record(conn, query, values,
+                                  time.perf_counter() - start,
+                                  max(cursor.rowcount, 0))
+                    if many or rowcount:
+                        return cursor.rowcount
+                    return cursor.lastrowid
+                finally:
+                    cursor.close()
         except Exception as err:
+            if pool.inTransaction():
+                raise
             return '**ERROR**\n__GetSQLiteData : ' + str(err)
-        finally:
+
+#-------------------------------------------------------------------------------
+
+    def __cachedFetch(self, query, values, native):
+        """ fetch() through the query cache. Inside a transaction the cache is
+            not used, as the thread may be reading its own uncommitted data. """
+
+        pool = self.pool
+        cache = pool.queryCache
+        if pool.inTransaction():
+            return self.__GetSQLiteData(query, values, native)
+        try:
+            cache.checkVersion(pool.dataVersion())
+        except sqlite3.Error as err:
+            return '**ERROR**\n__cachedFetch : ' + str(err)
+
+        if isinstance(values, dict):
+            key = (query, tuple(sorted(values.items())), native)
+        else:
+            key = (query, tuple(values), native)
+        hit, ret = cache.get(key)
+        if hit:
+            return copyResult(ret)
+
+        generation = ret
+        ret = self.__GetSQLiteData(query, values, native)
+        if not isinstance(ret, str):
+            with pool.connection() as conn:
+                tables = self.__tablesUsed(conn, query, values, False)
+            if tables:
+                cache.put(key, tables, copyResult(ret), generation)
+        return ret
+
+#-------------------------------------------------------------------------------
+
+    def __tablesUsed(self, conn, query, values, write):
+        """ Return the set of (lower-case) tables read by a query, or written
+            by an insert/update/delete (including the tables written by its
+            triggers). None if they can't be worked out, which for a write
+            means any table may have changed.
+            They are found from the EXPLAIN output for the query : the root
+            pages of the tables (and indexes) that it opens, looked up in the
+            schema catalog. This sees through views and sub-queries. """
+
+        schema = self.catalog.objects()
+        cache = self.pool.queryCache
+        tables = cache.tables(query, schema)
+        if tables is not None:
+            return tables or None
+
+        words = query.split(None, 1)
+        first = words[0].lower() if words else ''
+        tables = set()
+        if first in ('select', 'with', 'insert', 'replace', 'update', 'delete'):
+            pages = {obj.rootpage: (obj.table if obj.type == 'index' else
+                                    obj.name).lower()
+                     for obj in schema.values() if obj.rootpage}
+            opcode = 'OpenWrite' if write else 'OpenRead'
             try:
-                cursor.close()
-                del cursor
-                conn.close()
-            except:
-                pass
+                # Columns : addr, opcode, p1 (cursor), p2 (root page),
+                # p3 (database - 0 is main), p4, p5, comment
+                for row in conn.execute('Explain ' + query, values):
+                    if row[1] == opcode and row[4] == 0:
+                        if row[3] not in pages:
+                            tables = set()
+                            break
+                        tables.add(pages[row[3]])
+            except sqlite3.Error:
+                tables = set()
+        if write:
+            tables = self.__triggerTables(tables, schema)
+
+        cache.setTables(query, schema, frozenset(tables))
+        return frozenset(tables) or None
+
+#-------------------------------------------------------------------------------
+
+    def __triggerTables(self, tables, schema):
+        """ Add to the written tables every table written by their triggers
+            (and the triggers on those, and so on). """
+
+        pattern = re.compile(r'\b(?:insert(?:\s+or\s+\w+)?\s+into|replace\s+'
+                             r'into|update(?:\s+or\s+\w+)?|delete\s+from)\s+'
+                             r'(?:main\.)?("(?:[^"]|"")+"|\[[^\]]+\]|\w+)', re.I)
+        todo = list(tables)
+        while todo:
+            table = todo.pop()
+            for obj in schema.values():
+                if obj.type != 'trigger' or obj.table.lower() != table:
+                    continue
+                body = re.split(r'\bbegin\b', obj.sql or '', maxsplit=1,
+                                flags=re.I)[-1]
+                for name in pattern.findall(body):
+                    name = name.strip('"[]').replace('""', '"').lower()
+                    if name in schema and name not in tables:
+                        tables.add(name)
+                        todo.append(name)
+        return tables
+
+#-------------------------------------------------------------------------------
+
+    def __offsetPage(self, obj, pageSize, after, before, start, last):
+        """ getTablePage for a view, where the key is the row position. Views
+            have to be run from the start anyway, so Offset costs no more
+            than the view itself. """
+
+        name = quoteName(obj.name)
+        offset = 0
+        try:
+            if after is not None:
+                offset = int(after[0]) + 1
+            elif before is not None:
+                offset = int(before[0]) - pageSize
+            elif start is not None:
+                offset = int(start)
+        except (TypeError, ValueError, IndexError):
+            offset = 0      # not a row number (e.g. typed in) - first page
+        offset = max(offset, 0)
+
+        if last and after is None and before is None and start is None:
+            ret = self.fetch(f'Select count(*) From {name};', native=True)
+            if isinstance(ret, str):
+                return ret
+            total = ret[1][0][0]
+            offset = max(total - (total % pageSize or pageSize), 0)
+
+        ret = self.fetch(f'Select * From {name} Limit ? Offset ?;',
+                         [pageSize + 1, offset], native=True)
+        if isinstance(ret, str):
+            return ret
+        cols, rows = ret
+
+        page = {'rows': [list(cols)], 'first': None, 'last': None,
+                'prev': offset > 0, 'next': len(rows) > pageSize,
+                'keyed': False}
+        rows = rows[:pageSize]
+        if rows:
+            page['rows'] += [[str(col) for col in row] for row in rows]
+            page['first'] = [offset]
+            page['last'] = [offset + len(rows) - 1]
+        return page
+
+#-------------------------------------------------------------------------------
+
+    def __getDefinition(self, name, type):
+        """ Return the sql for the named schema object, in the same layout as
+            a query on sqlite_master - [['sql'], [definition]]. """
+
+        ret = [['sql']]
+        obj = self.catalog.get(name)
+        if obj is not None and obj.type == type:
+            ret.append([str(obj.sql)])
+        return ret
+
+#-------------------------------------------------------------------------------
+
+    def __record(self, conn, query, values, seconds, rows):
+        """ Add a statement's timing to the query statistics. If it was slow,
+            get its query plan (on the same connection) for the slow log. """
+
+        stats = self.pool.queryStats
+        plan = None
+        if stats.isSlow(seconds):
+            plan = self.__explain(conn, query, values)
+        stats.record(query, seconds, rows, plan)
+
+#-------------------------------------------------------------------------------
+
+    def __explain(self, conn, query, values):
+        """ Return the EXPLAIN QUERY PLAN output for the query as a list of
+            strings, indented to show the structure of the plan. """
+
+        try:
+            rows = conn.execute('Explain Query Plan ' + query, values).fetchall()
+        except sqlite3.Error as err:
+            return ['(no query plan : ' + str(err) + ')']
+
+        depth, plan = {0: -1}, []
+        for ident, parent, _, detail in rows:
+            depth[ident] = depth.get(parent, -1) + 1
+            plan.append('    ' * depth[ident] + detail)
+        return plan
 
 #-------------------------------------------------------------------------------
 
@@ -273,5 +1669,16 @@ class SQLClass:
             ret.append(record)
         return ret
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+
+    def __NativeOutput(self, cursor):
+        """ Return the cursor data as (columns, rows). The rows are the tuples
+            produced by the sqlite3 module itself, so nothing is copied or
+            converted. """
+
+        colnames = tuple(col[0] for col in cursor.description)
+        return colnames, cursor.fetchall()
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
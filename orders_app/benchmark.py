@@ -0,0 +1,130 @@
+"""
+ Name:          benchmark.py
+
+ Purpose:       Timings for the weather calculations in weathercalc.py - the
+                array versions (wetBulbArray, dayLengthArray) against calling
+                the original one-reading-at-a-time code in a loop, for 10^5
+                and 10^6 readings. The results of both are checked to be the
+                same. Only NumPy is needed, not the website. From the
+                orders_app folder :
+
+                    python benchmark.py [readings ...]
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+import math
+import random
+import sys
+import time
+from datetime import datetime
+
+import weathercalc as wc
+
+#-------------------------------------------------------------------------------
+
+def loopDayLength(start, end):
+    """ getDayLength as it was before the array version - for comparison. """
+
+    start = start.replace(' ', '')
+    start = datetime.strptime(start, '%I:%M%p').strftime('%H:%M')
+    end = end.replace(' ', '')
+    end = datetime.strptime(end, '%I:%M%p').strftime('%H:%M')
+
+    tdelta = datetime.strptime(end, '%H:%M') - datetime.strptime(start, '%H:%M')
+    hours = (tdelta.seconds/3600)
+
+    return str(round(hours, 2))
+
+def loopWetBulb(tempC, humidity):
+    """ calcWetBulb as it was before the array version - for comparison. """
+
+    a = tempC * math.atan(0.151977 * (humidity + 8.313659) ** 0.5)
+    b = math.atan(tempC + humidity) - math.atan(humidity - 1.676331)
+    c = 0.00391838 * humidity ** (1.5) * math.atan(0.023101 * humidity)
+    d = -4.686035
+    wetbulbC = a + b + c + d
+
+    return str(round(wetbulbC, 2)), str(round((wetbulbC * 1.8 + 32), 2))
+
+#-------------------------------------------------------------------------------
+
+def readings(count):
+    """ Return lists of random temperatures, humidities, sunrise and sunset
+        times for 'count' readings. """
+
+    def clock(hour):
+        ampm = 'PM' if hour >= 12 else 'AM'
+        return f'{(hour - 1) % 12 + 1:02}:{random.randrange(60):02} {ampm}'
+
+    temps = [round(random.uniform(-10, 35), 1) for _ in range(count)]
+    humidity = [random.randrange(5, 101) for _ in range(count)]
+    rises = [clock(random.randrange(24)) for _ in range(count)]
+    sets = [clock(random.randrange(24)) for _ in range(count)]
+    return temps, humidity, rises, sets
+
+#-------------------------------------------------------------------------------
+
+def timed(func, *args):
+    """ Return the result of func(*args), and the seconds it took. """
+
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+#-------------------------------------------------------------------------------
+
+def compare(count):
+    """ Time and check both versions of each calculation for 'count'
+        readings, and print the results. """
+
+    temps, humidity, rises, sets = readings(count)
+    print(f'{count:,} readings')
+
+    old, loopSecs = timed(lambda: [loopWetBulb(t, h)
+                                   for t, h in zip(temps, humidity)])
+    (wetC, wetF), arraySecs = timed(wc.wetBulbArray, temps, humidity)
+    same = all(pair == (str(round(c, 2)), str(round(f, 2)))
+               for pair, c, f in zip(old, wetC.tolist(), wetF.tolist()))
+    report('calcWetBulb', loopSecs, arraySecs, same)
+
+    old, loopSecs = timed(lambda: [loopDayLength(r, s)
+                                   for r, s in zip(rises, sets)])
+    hours, arraySecs = timed(wc.dayLengthArray, rises, sets)
+    same = all(value == str(round(h, 2))
+               for value, h in zip(old, hours.tolist()))
+    report('getDayLength', loopSecs, arraySecs, same)
+
+def report(name, loopSecs, arraySecs, same):
+
+    print(f'\t{name:<14} loop {loopSecs * 1000:9.1f} ms   '
+          f'array {arraySecs * 1000:7.1f} ms   '
+          f'x{loopSecs / arraySecs:6.1f}   '
+          f'{"same results" if same else "RESULTS DIFFER"}')
+
+#-------------------------------------------------------------------------------
+
+def main():
+    """ Run the comparison for the sizes given on the command line (default
+        10^5 and 10^6 readings). """
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10 ** 5, 10 ** 6]
+    random.seed(1)
+    for count in sizes:
+        compare(count)
+
+    return
+
+    #return
+    from subprocess import Popen
+    Popen('pdoc benchmark.py -o ./docs')
+    print('HTML docs produced for this module')
+
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
+#-------------------------------------------------------------------------------
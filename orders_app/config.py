@@ -12,6 +12,10 @@
 
 import os
 
+# The folder holding this package, for paths that mustn't depend on the
+# current directory.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 #-------------------------------------------------------------------------------
 
 class Config():
@@ -25,17 +29,51 @@ class Config():
     PHOTO_DIR = 'static/images/'
     MUSIC_DIR = 'static/music/'
     VIDEO_DIR = 'static/video/'
-    # API details for the Weather API site
-    API_KEY = 'my api key'
-    API_URL1 = 'https://api.weatherapi.com/v1/current.json'
-    API_URL2 = 'https://api.weatherapi.com/v1/astronomy.json'
+    # API details for the Weather API site. Set WEATHER_API_BASE to use a
+    # different server, e.g. the local stub in weatherstub.py.
+    API_KEY = os.environ.get('WEATHER_API_KEY') or 'my api key'
+    API_BASE = (os.environ.get('WEATHER_API_BASE') or
+                'https://api.weatherapi.com/v1')
+    API_URL1 = API_BASE + '/current.json'
+    API_URL2 = API_BASE + '/astronomy.json'
+    WEATHER_CURRENT_TTL = 600           # seconds before these are refreshed
+    WEATHER_ASTRO_TTL = 6 * 3600        # (in the background)
+    WEATHER_STALE_SECONDS = 24 * 3600   # older results are fetched again first
+    WEATHER_TIMEOUT = 10                # seconds to wait for the API site
+    WEATHER_WORKERS = 4                 # threads for the API calls
+    # Background refresh of every location, in seconds (0 = off, e.g. 900).
+    # It only runs once a real API_KEY is set.
+    WEATHER_PREFETCH_INTERVAL = int(os.environ.get('WEATHER_PREFETCH_INTERVAL')
+                                    or 0)
+    WEATHER_RATE_LIMIT = 60             # max. API calls a minute
+    WEATHER_JITTER = 0.1                # vary the interval by up to 10%
     # API details for YouTube videos
     YT_KEY = 'my api key'
     YT_API_URL = 'https://www.googleapis.com/youtube/v3/videos?part=snippet&id={id}&key={apiKey}'
     YT_VID_URL = 'https://www.youtube.com/embed/'
     # Other stuff
     PAGE_SIZE = 15
-    DATABASE = 'FlaskWebsite.db'
+    MUSIC_PAGE_SIZE = 10
+    IMAGE_PAGE_SIZE = 12
+    DATABASE = (os.environ.get('DATABASE') or
+                os.path.join(BASE_DIR, 'FlaskWebsite.db'))
+    # PRAGMA settings for the database connections - one of the profiles in
+    # SQLiteDatabase.PROFILES ('default', 'safe' or 'performance').
+    DB_PROFILE = os.environ.get('DB_PROFILE') or 'performance'
+    SLOW_QUERY_MS = 50          # statements slower than this are logged
+    DB_POOL_SIZE = 8            # max. open connections to the database
+    QUERY_CACHE_SIZE = 256      # max. cached query results (0 = no cache)
+    # Server-side DataStore (datastore.py) - 'memory' keeps the data in this
+    # process only, 'sqlite' in DATASTORE_FILE, shared by every process.
+    DATASTORE_BACKEND = os.environ.get('DATASTORE_BACKEND') or 'memory'
+    DATASTORE_FILE = (os.environ.get('DATASTORE_FILE') or
+                      os.path.join(BASE_DIR, 'DataStore.db'))
+    DATASTORE_SESSION_BYTES = 8 * 1024 * 1024   # for each browser session
+    DATASTORE_TOTAL_BYTES = 256 * 1024 * 1024   # for all sessions together
+    DATASTORE_IDLE_SECONDS = 3600               # sessions unused for longer
+                                                # than this are dropped
+    DATASTORE_COMPRESS_BYTES = 16 * 1024        # values this size or larger
+                                                # are pickled and compressed
 
 
 #-------------------------------------------------------------------------------
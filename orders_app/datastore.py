@@ -15,56 +15,579 @@
  Amended:       22/08/2024
                 Use a single dictionary as the data store, to mimic the way
                 that the built-in session object works.
+
+                17/10/2026
+                Keep a separate store (namespace) for each browser session,
+                identified by a random id held in the session as '_dsid', so
+                users no longer overwrite each other's data. Memory use is
+                bounded : each session has a size budget (its least recently
+                used keys are dropped when over it), the whole store has a
+                budget (the least recently used sessions are dropped), and
+                sessions idle for too long are dropped. The limits are
+                applied after each request, in an after_request hook.
+
+                17/10/2026
+                The sessions are kept by a backend : MemoryBackend (in this
+                process, as before) or SQLiteBackend (a database file in WAL
+                mode, shared by all of the worker processes, with the values
+                pickled). Each request works on a view of its session's
+                store, loaded on first use, and the keys it has changed are
+                written back to the backend at the end of the request.
+
+                17/10/2026
+                The size of each value is estimated (deepSize) when it is
+                stored, and kept with it, instead of converting the whole
+                store to a string to measure it. storeContents just adds up
+                the sizes. Eviction uses them too : the largest keys not used
+                in the current request go first, and then the sessions with
+                the most data unused for the longest.
+
+                17/10/2026
+                Large values (DATASTORE_COMPRESS_BYTES or more) are pickled
+                and compressed with zlib at the end of the request, and only
+                expanded again when they are next read. The format of each
+                entry, the compression ratio and the time spent packing and
+                unpacking are shown by storeContents.
 """
 #-------------------------------------------------------------------------------
 
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 from sys import getsizeof
 
+from flask import g, has_request_context, session
+
+import orders_app.SQLiteDatabase as sld
+
+# The namespace used outside of a request (e.g. from main() below)
+DEFAULT = 'default'
+# Containers whose contents are counted by deepSize
+_CONTAINERS = (list, tuple, set, frozenset, dict)
+# Values that hold no references to other objects
+_ATOMS = (str, bytes, int, float, bool, type(None))
+
+def deepSize(value):
+    """ Return an estimate, in bytes, of the memory used by a value and
+        everything it contains (lists, tuples, sets and dictionaries are
+        followed; any other object counts as its own size). Objects referred
+        to more than once are only counted once. """
+
+    size = 0
+    seen = set()
+    todo = [value]
+    while todo:
+        item = todo.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += getsizeof(item)
+        if isinstance(item, dict):
+            todo.extend(item.keys())
+            todo.extend(item.values())
+        elif isinstance(item, _CONTAINERS):
+            # Lists of plain values (e.g. rows of strings) in one go
+            if all(type(elem) in _ATOMS for elem in item):
+                size += sum(map(getsizeof, item))
+            else:
+                todo.extend(item)
+    return size
+
+#-------------------------------------------------------------------------------
+
+class Packed():
+    """ A value held pickled and compressed. 'rawSize' is the deepSize of the
+        value itself, and 'seconds' the CPU time taken to pack it. """
+
+    __slots__ = ('data', 'rawSize', 'seconds')
+    format = 'pickle+zlib'
+
+    def __init__(self, value, rawSize):
+
+        start = time.process_time()
+        self.data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                                  1)
+        self.rawSize = rawSize
+        self.seconds = time.process_time() - start
+
+    def unpack(self):
+        """ Return the value. """
+
+        return pickle.loads(zlib.decompress(self.data))
+
+#-------------------------------------------------------------------------------
+
+class Namespace(OrderedDict):
+    """ The store for one session - a dictionary that keeps its keys in least
+        recently used order (oldest first), for eviction. It records which
+        keys have been used (and so may have been changed) or deleted since
+        it was last written back to the backend. The size of each value is
+        estimated when it is stored - a value changed in place (rather than
+        stored again) keeps its old size. Large values may be held as Packed
+        objects (see pack); reading one expands it for the rest of the
+        request, and unless it is stored again it is put back as it was
+        afterwards, so a packed value changed in place must be stored again
+        for the change to be kept. """
+
+    def __init__(self, items=(), sizes=None):
+
+        super().__init__()
+        self.touched = set()
+        self.deleted = set()
+        self.sizes = {}             # key : bytes (deepSize)
+        self.size = 0               # total of sizes
+        self.lastUsed = time.time()
+        self.unpacked = {}          # key : Packed, for values expanded
+        self.unpackSeconds = 0.0    # CPU time spent expanding them
+        sizes = sizes or {}
+        for key, value in items:
+            OrderedDict.__setitem__(self, key, value)
+            self.sizes[key] = sizes.get(key) or deepSize(value)
+            self.size += self.sizes[key]
+
+    def __getitem__(self, key):
+
+        value = super().__getitem__(key)
+        if isinstance(value, Packed):
+            start = time.process_time()
+            self.unpacked[key] = value
+            value = value.unpack()
+            OrderedDict.__setitem__(self, key, value)
+            self.unpackSeconds += time.process_time() - start
+        self.move_to_end(key)
+        self.touched.add(key)
+        return value
+
+    def __setitem__(self, key, value):
+
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        self.touched.add(key)
+        self.deleted.discard(key)
+        self.unpacked.pop(key, None)
+        size = deepSize(value)
+        self.size += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+
+    def __delitem__(self, key):
+
+        super().__delitem__(key)
+        self.size -= self.sizes.pop(key, 0)
+        self.unpacked.pop(key, None)
+        self.touched.discard(key)
+        self.deleted.add(key)
+
+    def get(self, key, default=None):
+
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def clear(self):
+
+        for key in list(self.keys()):
+            del self[key]
+
+    def reset(self):
+        """ Remove every key, and forget any changes not yet written back
+            (so the removals aren't written back either). """
+
+        OrderedDict.clear(self)
+        self.sizes.clear()
+        self.size = 0
+        self.touched.clear()
+        self.deleted.clear()
+        self.unpacked.clear()
+        self.unpackSeconds = 0.0
+
+    def pack(self, threshold):
+        """ Pack the values used in this request whose size is 'threshold'
+            bytes or more (if that makes them smaller), and put back the
+            packed form of any that were only read. Return the CPU time
+            taken packing. """
+
+        seconds = 0.0
+        for key in self.touched:
+            if key not in self:
+                continue
+            if key in self.unpacked:
+                OrderedDict.__setitem__(self, key, self.unpacked.pop(key))
+                continue
+            value = dict.__getitem__(self, key)
+            size = self.sizes.get(key, 0)
+            if isinstance(value, Packed) or size < threshold:
+                continue
+            packed = Packed(value, size)
+            seconds += packed.seconds
+            packedSize = getsizeof(packed) + getsizeof(packed.data)
+            if packedSize < size:
+                OrderedDict.__setitem__(self, key, packed)
+                self.sizes[key] = packedSize
+                self.size += packedSize - size
+        return seconds
+
+    def packedValue(self, key):
+        """ Return the Packed object for a key held packed, otherwise None. """
+
+        value = self.unpacked.get(key, dict.get(self, key))
+        return value if isinstance(value, Packed) else None
+
+#-------------------------------------------------------------------------------
+
+class MemoryBackend():
+    """ Keeps every session's Namespace in this process. A request works on
+        the Namespace itself, so there is nothing to write back. Only suitable
+        for a single server process. """
+
+    def __init__(self):
+
+        self.__spaces = OrderedDict()   # session id : Namespace, LRU first
+        self.__lock = threading.Lock()
+
+    def load(self, sid):
+        """ Return the Namespace for the session (empty if it's new). """
+
+        with self.__lock:
+            space = self.__spaces.get(sid)
+            if space is None:
+                space = Namespace()
+                self.__spaces[sid] = space
+            self.__spaces.move_to_end(sid)
+            space.lastUsed = time.time()
+            return space
+
+    def save(self, sid, space):
+        """ Record that the session's changes are complete. """
+
+        with self.__lock:
+            space.touched.clear()
+            space.deleted.clear()
+            if sid in self.__spaces:
+                self.__spaces.move_to_end(sid)
+            elif len(space):
+                # Stored to after the session was cleared or dropped
+                self.__spaces[sid] = space
+            space.lastUsed = time.time()
+
+    def sessions(self):
+        """ Return [session id, size, last used time] for every session, least
+            recently used first. """
+
+        with self.__lock:
+            return [[sid, space.size, space.lastUsed]
+                    for sid, space in self.__spaces.items()]
+
+    def delete(self, sid):
+        """ Remove a session. """
+
+        with self.__lock:
+            self.__spaces.pop(sid, None)
+
+    def clear(self):
+        """ Remove every session. """
+
+        with self.__lock:
+            for space in self.__spaces.values():
+                space.reset()
+            self.__spaces.clear()
+
+#-------------------------------------------------------------------------------
+
+class SQLiteBackend():
+    """ Keeps the sessions in a SQLite database file, so that every worker
+        process sees the same data. One row per key, with the value pickled.
+        The file uses the 'performance' connection profile (WAL journal, so
+        readers don't block the writer). """
+
+    def __init__(self, path):
+
+        self.sql = sld.SQLClass()
+        self.sql.db = path
+        self.sql.profile = 'performance'
+        query = 'Create Table If Not Exists Entries ('
+        query += 'SessionId text Not NULL, Key text Not NULL, '
+        query += 'Value blob, Size integer Not NULL, Used real Not NULL, '
+        query += 'Primary Key (SessionId, Key)) Without Rowid; '
+        self.sql.execute(query)
+
+    def load(self, sid):
+        """ Return a new Namespace holding the session's keys, least recently
+            used first. """
+
+        query = 'Select Key, Value, Size From Entries Where SessionId = ? '
+        query += 'Order By Used; '
+        ret = self.sql.fetch(query, [sid], native=True)
+        if isinstance(ret, str):
+            return Namespace()
+        rows = ret[1]
+        return Namespace([(key, pickle.loads(value)) for key, value, _ in rows],
+                         {key: size for key, _, size in rows})
+
+    def save(self, sid, space):
+        """ Write the keys used in this request, and delete the ones deleted. """
+
+        now = time.time()
+        rows = []
+        for key in space.touched:
+            if key in space:
+                value = pickle.dumps(dict.__getitem__(space, key),
+                                     pickle.HIGHEST_PROTOCOL)
+                rows.append((sid, key, value, space.sizes.get(key, 0), now))
+        with self.sql.transaction():
+            if rows:
+                self.sql.bulkInsert('Entries', ['SessionId', 'Key', 'Value',
+                                                'Size', 'Used'], rows,
+                                    conflict=['SessionId', 'Key'])
+            if space.deleted:
+                self.sql.executeMany('Delete From Entries Where SessionId = ? '
+                                     'And Key = ?; ',
+                                     [(sid, key) for key in space.deleted])
+        space.touched.clear()
+        space.deleted.clear()
+
+    def sessions(self):
+        """ Return [session id, size, last used time] for every session, least
+            recently used first. """
+
+        query = 'Select SessionId, sum(Size), max(Used) From Entries '
+        query += 'Group By SessionId Order By 3; '
+        ret = self.sql.fetch(query, native=True)
+        return [] if isinstance(ret, str) else [list(row) for row in ret[1]]
+
+    def delete(self, sid):
+        """ Remove a session. """
+
+        self.sql.execute('Delete From Entries Where SessionId = ?; ', [sid])
+
+    def clear(self):
+        """ Remove every session. """
+
+        self.sql.execute('Delete From Entries; ')
+
+#-------------------------------------------------------------------------------
+
 class DataStore():
     """ Each screen will store its session variables in the 'store' dictionary.
         Take care to use different keys for each variable, otherwise strange
-        things may happen!  """
+        things may happen! 'store' is the dictionary for the current browser
+        session. Pass the Flask app (or call initApp) to read the settings
+        from its config and apply them after each request :
+            DATASTORE_BACKEND       - 'memory' or 'sqlite'
+            DATASTORE_FILE          - the database file for 'sqlite'
+            DATASTORE_SESSION_BYTES - size budget for one session
+            DATASTORE_TOTAL_BYTES   - size budget for all sessions together
+            DATASTORE_IDLE_SECONDS  - sessions unused for longer are dropped
+            DATASTORE_COMPRESS_BYTES - values this size or larger are packed
+    """
+
+    def __init__(self, app=None, backend=None):
+
+        self.backend = backend or MemoryBackend()
+        self.sessionBytes = 8 * 1024 * 1024
+        self.totalBytes = 256 * 1024 * 1024
+        self.idleSeconds = 3600
+        self.compressBytes = 16 * 1024
+        self.sweepSeconds = 10      # how often to check the whole store
+        self.packSeconds = 0.0      # CPU time spent packing values
+        self.unpackSeconds = 0.0    # and expanding them
+        self.evicted = 0            # keys dropped to keep within the budgets
+        self.expired = 0            # sessions dropped (idle, or over budget)
+        self.__default = Namespace()
+        self.__lastSweep = 0.0
+        self.__lock = threading.RLock()
+        if app is not None:
+            self.initApp(app)
+
+#-------------------------------------------------------------------------------
+
+    def initApp(self, app):
+        """ Read the settings from the app config, and register the hook that
+            writes back and applies the limits at the end of each request. """
 
-    store = {}
+        if app.config.get('DATASTORE_BACKEND', 'memory') == 'sqlite':
+            self.backend = SQLiteBackend(app.config.get('DATASTORE_FILE',
+                                                        'DataStore.db'))
+        self.sessionBytes = app.config.get('DATASTORE_SESSION_BYTES',
+                                           self.sessionBytes)
+        self.totalBytes = app.config.get('DATASTORE_TOTAL_BYTES',
+                                         self.totalBytes)
+        self.idleSeconds = app.config.get('DATASTORE_IDLE_SECONDS',
+                                          self.idleSeconds)
+        self.compressBytes = app.config.get('DATASTORE_COMPRESS_BYTES',
+                                            self.compressBytes)
+        app.after_request(self.__afterRequest)
 
 #-------------------------------------------------------------------------------
 
-    def clearStore(self):
-        """ Set dictionary class variable to the default (empty) state.
+    @property
+    def store(self):
+        """ The dictionary for the current session. """
+
+        if not has_request_context():
+            return self.__default
+
+        space = g.get('dsView')
+        if space is None:
+            space = self.backend.load(self.__sessionId())
+            g.dsView = space
+        return space
+
+#-------------------------------------------------------------------------------
+
+    def clearStore(self, allSessions=False):
+        """ Set the current session's dictionary (or every session's, if
+            'allSessions' is True) to the default (empty) state.
             Print out the details for debugging. """
 
-        size = round(getsizeof(str(self.store)) / 1024, 2)
+        store = self.store
+        size = round(store.size / 1024, 2)
         print('--------------------------------')
         print('Details for the DataStore.store dictionary')
-        print(f'\tstore size : {getsizeof(self.store)} bytes')
+        print(f'\tstore size : {getsizeof(store)} bytes')
         print(f'\tdata size  : {size} kb')
 
         print('Keys in store dictionary :')
-        if self.store.keys():
-            for key in self.store.keys():
+        if store.keys():
+            for key in store.keys():
                 print('\t' + key)
         else:
             print('\tDictionary is empty!')
 
-        self.store = {}
+        if allSessions:
+            self.backend.clear()
+        store.clear()
 
 #-------------------------------------------------------------------------------
 
     def storeContents(self):
-        """ Return a list of the current keys in "store", with their sizes, plus
-            the overall size and the size of the dictionary internal structure. """
+        """ Return a summary of the whole store (a list of [name, value]), and a
+            list of the keys in the current session's "store", with their
+            sizes. """
+
+        store = self.store
+        sessions = self.backend.sessions()
+        total = sum(item[1] for item in sessions)
+
+        summary = []
+        summary.append(['Backend', type(self.backend).__name__])
+        summary.append(['Sessions', f'{len(sessions)} ({self.expired} dropped, '
+                                    f'{self.evicted} keys evicted)'])
+        summary.append(['Total Data Size', f'{round(total / 1024, 2)} kb of '
+                        f'{round(self.totalBytes / 1024)} kb'])
+        summary.append(['This Session', f'{round(store.size / 1024, 2)} kb of '
+                        f'{round(self.sessionBytes / 1024)} kb'])
 
         res = []
+        raw = held = 0
+        for key, size in list(store.sizes.items()):
+            packed = store.packedValue(key)
+            if packed is None:
+                res.append([key, f'{size} bytes'])
+                continue
+            raw += packed.rawSize
+            held += size
+            res.append([key, f'{size} bytes ({packed.format}, '
+                             f'{packed.rawSize} bytes unpacked, '
+                             f'{round(100 * size / packed.rawSize)}%)'])
 
-        res.append(['Dictionary Structure', f'{getsizeof(self.store)} bytes'])
-        res.append(['Total Data Size',
-                    f'{round(getsizeof(str(self.store)) / 1024, 2)} kb'])
-        if self.store.keys():
-            for key in self.store.keys():
-                size = getsizeof(str(self.store[key]))
-                res.append([key, str(size) + ' bytes'])
+        ratio = f'{round(raw / held, 1)} : 1' if held else 'none packed'
+        summary.append(['Compression', f'{ratio} for this session, values of '
+                        f'{round(self.compressBytes / 1024)} kb or more'])
+        summary.append(['Packing CPU Time', f'{round(self.packSeconds * 1000)} '
+                        f'ms packing, {round(self.unpackSeconds * 1000)} ms '
+                        'unpacking'])
 
-        return res
+        return summary, res
+
+#-------------------------------------------------------------------------------
+
+    def __sessionId(self):
+        """ Return the store id for the current session, creating one if it
+            doesn't have one yet. The '_dsid' key is not removed by logout. """
+
+        sid = session.get('_dsid')
+        if not sid:
+            sid = uuid.uuid4().hex
+            session['_dsid'] = sid
+        g.dsid = sid
+        return sid
+
+#-------------------------------------------------------------------------------
+
+    def __afterRequest(self, response):
+        """ Write back the request's view of its session's store, and apply
+            the limits, if the request used the store. """
+
+        space = g.pop('dsView', None)
+        if space is not None:
+            self.__flush(g.pop('dsid'), space)
+        return response
+
+#-------------------------------------------------------------------------------
+
+    def __flush(self, sid, space):
+        """ Pack the large values used in this request, then drop keys from
+            the session while it is over the session budget - the largest of
+            those not used in this request first, then the rest in least
+            recently used order - and write the changes back.
+            Every 'sweepSeconds', also drop sessions that have been idle too
+            long, and then, while the whole store is over the total budget,
+            the sessions with the largest size x time since last used. """
+
+        with self.__lock:
+            self.packSeconds += space.pack(self.compressBytes)
+            self.unpackSeconds += space.unpackSeconds
+            space.unpackSeconds = 0.0
+            if space.size > self.sessionBytes:
+                unused = sorted((key for key in space if key not in
+                                 space.touched),
+                                key=lambda key: space.sizes.get(key, 0),
+                                reverse=True)
+                for key in unused + list(space):
+                    if space.size <= self.sessionBytes:
+                        break
+                    if key in space:
+                        del space[key]
+                        self.evicted += 1
+            self.backend.save(sid, space)
+
+            now = time.time()
+            if now - self.__lastSweep < self.sweepSeconds:
+                return
+            self.__lastSweep = now
+
+            sessions = self.backend.sessions()
+            total = sum(item[1] for item in sessions)
+            cutoff = now - self.idleSeconds
+            others = []
+            for key, size, used in sessions:
+                if key == sid:
+                    continue
+                if used < cutoff:
+                    total -= size
+                    self.backend.delete(key)
+                    self.expired += 1
+                else:
+                    others.append((size * (now - used), key, size))
+
+            others.sort(reverse=True)
+            for _, key, size in others:
+                if total <= self.totalBytes:
+                    break
+                total -= size
+                self.backend.delete(key)
+                self.expired += 1
 
 #-------------------------------------------------------------------------------
 
@@ -72,10 +595,34 @@ def main():
     """ Test code """
 
     ds = DataStore()
-    res = ds.storeContents()
-    for item in res:
+    ds.store['test'] = list(range(1000))
+    summary, res = ds.storeContents()
+    for item in summary + res:
         print(item)
 
+    # Clear every session's store, then use the session's store again
+    from flask import Flask
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    ds = DataStore(app)
+
+    @app.route('/<action>')
+    def action(action):
+        if action == 'set':
+            ds.store['test'] = list(range(1000))
+        elif action == 'clear':
+            ds.clearStore(allSessions=True)
+            ds.store['after'] = 'x'
+        return ','.join(f'{key}={ds.store.sizes[key]}' for key in ds.store)
+
+    client = app.test_client()
+    client.get('/set')
+    assert client.get('/clear').text.startswith('after=')
+    assert client.get('/get').text.startswith('after=')
+    client.get('/set')
+    assert client.get('/get').text.split(',')[0].startswith('after=')
+    print('clearStore test passed')
+
     return
 
     #return
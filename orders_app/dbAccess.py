@@ -12,7 +12,109 @@
 
  Created:       28/07/2024
 
- Amended:
+ Amended:       17/10/2026
+                The SQLClass object now draws its connections from a pool
+                (sized by DB_POOL_SIZE in config.py), so queries no longer
+                open and close the database file every time.
+
+                17/10/2026
+                All queries now go through sql.fetch()/sql.execute(), passing
+                the query and values as arguments. Setting sql.query and
+                sql.values on the shared module-level object was not safe
+                with more than one request thread.
+
+                17/10/2026
+                getCatCounts and getItemCosts use the native result mode, so
+                their numbers come back as numbers rather than strings.
+
+                17/10/2026
+                Add iterOrders, iterTableData and csvStream, so that large
+                result sets can be streamed out (as CSV) a batch at a time.
+
+                17/10/2026
+                storeAudio, storeNewImages and populateImageTable now write
+                all of their rows with sql.bulkInsert (executemany), with a
+                single commit instead of one per row.
+
+                17/10/2026
+                Apply the DB_PROFILE PRAGMA profile from config.py to the
+                database connections. getDbSettings reports it for the admin
+                screen.
+
+                17/10/2026
+                Add getQueryStats and resetQueryStats, giving the timings
+                that SQLClass records for every query, and the slow query log.
+
+                17/10/2026
+                Run the schema migrations in migrations.py at startup. The
+                first one adds the indexes these queries need.
+
+                17/10/2026
+                getCatCounts and getItemCosts read the ItemTotals and
+                CategoryTotals rollup tables (migration 2) instead of
+                aggregating all of OrderItems.
+
+                17/10/2026
+                Add refreshPriceHistory and getPriceChanges. The PriceChange
+                view now reads the PriceHistory table (migration 3), which is
+                brought up to date before the view is browsed or exported.
+
+                17/10/2026
+                Add refreshOrderSummary and getOrderSummary. The OrderSummary
+                view now reads the OrderSummaryData table (migration 4), which
+                is kept up to date an order at a time.
+
+                17/10/2026
+                getTables reads the row counts from the TableStats table
+                (migration 5) rather than counting every table, and caches
+                the result until PRAGMA data_version changes.
+
+                17/10/2026
+                getTableDets pages through the rows of a table or view with
+                SQLClass.getTablePage, and returns the page details with an
+                approximate total row count.
+
+                17/10/2026
+                getOrders can return a single page of orders, using a keyset
+                on (OrderDate, OrderId), and getOrderCount gives the number
+                of orders in a date range (cached until the data changes).
+
+                17/10/2026
+                The orders, music and image listings are paged with the
+                Paginator class (paginator.py) : orderPages, musicPages and
+                imagePages. getOrders, getAudio and getImageDetails read a
+                single page with SQLClass.fetchPage, and getOrderCount,
+                getAudioCount and getImageCount count the rows (the
+                Paginator caches the counts).
+
+                17/10/2026
+                getCat, getLocations, getImageDetails, getAudio, getVideo
+                and getAllUsers use the SQLClass query cache, which is
+                cleared table by table as the tables are written to. Add
+                getCacheStats for the admin screen.
+
+                17/10/2026
+                Add saveWeather, which records each observation from the
+                Weather API in WeatherHistory (migration 7), and
+                getWeatherSeries, which averages it over hours or days with
+                NumPy. wetBulbArray is calcWetBulb for whole arrays.
+
+                17/10/2026
+                Add dayLengthArray (and clockSeconds), getDayLength for whole
+                arrays of times, parsed as arrays of character codes rather
+                than with strptime. Both are now in weathercalc.py only.
+                getDayLength and calcWetBulb are now wrappers for the array
+                versions, so both always give the same results.
+
+                17/10/2026
+                getDayLength, calcWetBulb and their array versions moved to
+                weathercalc.py (which doesn't load the app). getDayLength,
+                calcWetBulb and wetBulbArray are imported from there.
+
+                17/10/2026
+                The migrations are run by migrate(), called before the first
+                request or by the 'flask migrate' command, rather than when
+                this module is imported.
 
 """
 #-------------------------------------------------------------------------------
@@ -21,13 +123,54 @@ import orders_app.SQLiteDatabase  as sld
 sql = sld.SQLClass()
 from orders_app import app
 sql.db = app.config['DATABASE']
-
+sql.poolSize = app.config['DB_POOL_SIZE']
+sql.profile = app.config['DB_PROFILE']
+sql.slowQueryMs = app.config['SLOW_QUERY_MS']
+sql.cacheSize = app.config['QUERY_CACHE_SIZE']
+
+# The database schema is brought up to date before the first request (or by
+# the 'flask --app orders_app migrate' command), not when this is imported.
+from orders_app.migrations import MIGRATIONS
+import threading
+_migrateLock = threading.Lock()
+_migrated = False
+
+def migrate():
+    """ Apply any migrations (migrations.py) not yet applied to the database,
+        the first time this is called. Return the versions applied. """
+
+    global _migrated
+    with _migrateLock:
+        if _migrated:
+            return []
+        applied = sql.migrate(MIGRATIONS)
+        _migrated = True
+        return applied
+
+@app.before_request
+def migrateFirst():
+    if not _migrated:
+        migrate()
+
+@app.cli.command('migrate')
+def migrateCommand():
+    """ Bring the database schema up to date. """
+
+    applied = migrate()
+    print(f'Migrations applied : {applied}' if applied else
+          'The database schema is up to date')
+
+from orders_app.paginator import Paginator
+
+import csv
 import datetime as dt
+import io
 from datetime import datetime
 from datetime import timedelta
-import math
 from pathlib import Path
+import numpy as np
 from PIL import Image
+from orders_app.weathercalc import getDayLength, calcWetBulb, wetBulbArray
 from tinytag import TinyTag
 
 # Methods for storing and checking hashed user passwords
@@ -38,96 +181,158 @@ from werkzeug.security import generate_password_hash, check_password_hash
 def getCat():
     """ Return a list of category descriptions and food flags. """
 
-    sql.query = 'Select CategoryDesc, Food From Category '
-    sql.query += ' Order By CategoryDesc; '
-    sql.values = []
-    ret = sql.GetSQLData()
+    query = 'Select CategoryDesc, Food From Category '
+    query += ' Order By CategoryDesc; '
+    ret = sql.fetch(query, cached=True)
     return ret[1:]
 
 #-------------------------------------------------------------------------------
 
 def getCatCounts():
-    """ Get item counts for each category, with percentages. """
-
-    sql.query = 'Select sum(Quantity) From OrderItems; '
-    sql.values = []
-    ret = sql.GetSQLData()
-    total = int(ret[1][0])
-
-    sql.query = 'Select c.CategoryDesc, sum(oi.Quantity) As "count" '
-    sql.query += 'From OrderItems oi '
-    sql.query += 'Inner Join Item i on oi.ItemId = i.ItemId Inner Join '
-    sql.query += 'Category c On i.CategoryId = c.CategoryId Group By '
-    sql.query += 'c.CategoryId Order By c.CategoryDesc; '
-    sql.values = []
-    ret = sql.GetSQLData()
-    ret = ret[1:]
-
-    # Calculate and add percentages to the list for each row
-    for idx, item in enumerate(ret):
-        pc = round(int(ret[idx][1]) * 100 / total, 2)
-        ret[idx] = ret[idx] + [str(pc)]
+    """ Get item counts for each category, with percentages. The counts and
+        percentages are returned as numbers, not strings. They are read from
+        the rollup tables (kept up to date by triggers), so the order history
+        is not re-aggregated on every call. """
 
-    return ret
+    query = 'Select sum(Quantity) From ItemTotals; '
+    cols, ret = sql.fetch(query, native=True)
+    total = ret[0][0]
+
+    query = 'Select c.CategoryDesc, ct.Quantity As "count" '
+    query += 'From CategoryTotals ct '
+    query += 'Inner Join Category c On ct.CategoryId = c.CategoryId '
+    query += 'Where ct.Lines > 0 Order By c.CategoryDesc; '
+    cols, ret = sql.fetch(query, native=True)
+
+    # Calculate and add percentages to each row
+    return [(desc, count, round(count * 100 / total, 2))
+            for desc, count in ret]
 
 #-------------------------------------------------------------------------------
 
 def getItemCosts():
     """ Get the cost of the top ten most expensive items, by total cost over
-        all orders. """
-
-    sql.query = 'Select oi.ItemId, i.ItemDesc, sum(oi.Quantity), '
-    sql.query += 'round(sum(oi.TotalCost),2) '
-    sql.query += 'From OrderItems oi Inner Join Item i On oi.ItemId = i.ItemId '
-    sql.query += 'Group By oi.ItemId Order By sum(oi.TotalCost) Desc '
-    sql.query += 'limit 10; '
-    sql.values = []
-    ret = sql.GetSQLData()
-    return ret[1:]
+        all orders. The quantities and costs are returned as numbers. They
+        are read from the ItemTotals rollup table (kept up to date by
+        triggers), using its index on TotalCost. """
+
+    query = 'Select t.ItemId, i.ItemDesc, t.Quantity, round(t.TotalCost, 2) '
+    query += 'From ItemTotals t Inner Join Item i On t.ItemId = i.ItemId '
+    query += 'Where t.Lines > 0 Order By t.TotalCost Desc '
+    query += 'limit 10; '
+    cols, ret = sql.fetch(query, native=True)
+    return ret
 
 #-------------------------------------------------------------------------------
 
-def getOrders(startDate, endDate):
-    """ Return the orders in the supplied date range. """
+def getOrders(startDate, endDate, pageSize=None, after=None, before=None,
+              start=None, last=False):
+    """ Return the orders in the supplied date range, in OrderDate, OrderId
+        order. Without a pageSize all of them are returned. With a pageSize,
+        only that page of orders is read from the database, and the page
+        dictionary from SQLClass.fetchPage is returned (the keys are
+        [OrderDate, OrderId]). """
+
+    columns = 'o.OrderDate, o.OrderDesc, count(oi.OrderId) as '
+    columns += '"Count", sum(oi.Quantity) as "Quantity", '
+    columns += 'round(sum(oi.TotalCost), 2) as "TotalCost" '
+    source = 'Orders o Inner Join OrderItems oi On o.OrderId = oi.OrderId'
+    where = 'o.OrderDate Between ? and ?'
+
+    if pageSize is None:
+        query = f'Select {columns} From {source} Where {where} '
+        query += 'Group By o.OrderDate, o.OrderId '
+        query += 'Order By o.OrderDate, o.OrderId; '
+        return sql.fetch(query, [startDate, endDate])[1:]
+
+    return sql.fetchPage(columns, source, ['o.OrderDate', 'o.OrderId'], where,
+                         [startDate, endDate], pageSize, after, before, start,
+                         last, group=True)
 
-    sql.query = 'Select o.OrderDate, o.OrderDesc, count(oi.OrderId) as '
-    sql.query += '"Count", sum(oi.Quantity) as "Quantity", '
-    sql.query += 'round(sum(oi.TotalCost), 2) as "TotalCost" '
-    sql.query += 'From Orders o Inner Join OrderItems oi On o.OrderId '
-    sql.query += '= oi.OrderId Where o.OrderDate Between ? and ? '
-    sql.query += 'Group By oi.OrderId; '
-    sql.values = [startDate, endDate]
-    ret = sql.GetSQLData()
-    return ret[1:]
+#-------------------------------------------------------------------------------
+
+def getOrderCount(startDate, endDate):
+    """ Return the number of orders (with at least one item) in the supplied
+        date range. """
+
+    query = 'Select count(*) From Orders o Where o.OrderDate '
+    query += 'Between ? and ? And Exists (Select 1 From OrderItems oi '
+    query += 'Where oi.OrderId = o.OrderId); '
+    return sql.fetch(query, [startDate, endDate], native=True)[1][0][0]
+
+#-------------------------------------------------------------------------------
+
+def iterOrders(startDate, endDate):
+    """ Generator version of getOrders, for exports. The first item is the
+        list of column names, then one list per order. """
+
+    query = 'Select o.OrderDate, o.OrderDesc, count(oi.OrderId) as '
+    query += '"Count", sum(oi.Quantity) as "Quantity", '
+    query += 'round(sum(oi.TotalCost), 2) as "TotalCost" '
+    query += 'From Orders o Inner Join OrderItems oi On o.OrderId '
+    query += '= oi.OrderId Where o.OrderDate Between ? and ? '
+    query += 'Group By o.OrderDate, o.OrderId '
+    query += 'Order By o.OrderDate, o.OrderId; '
+    return sql.iterate(query, [startDate, endDate])
 
 #-------------------------------------------------------------------------------
 
 def getAllUsers():
     """ Return a list of all users (for the admin screen) """
 
-    sql.query = 'Select Username, Email, upper(Admin) From Users '
-    sql.query += 'Order by Username; '
-    sql.values = []
-    ret = sql.GetSQLData()
+    query = 'Select Username, Email, upper(Admin) From Users '
+    query += 'Order by Username; '
+    ret = sql.fetch(query, cached=True)
     return ret[1:]
 
 #-------------------------------------------------------------------------------
 
+def getDbSettings():
+    """ Return the name of the active database PRAGMA profile, and a list of
+        [setting, value] pairs as currently in force (for the admin screen). """
+
+    return sql.profile, sql.getSettings()
+
+#-------------------------------------------------------------------------------
+
+def getQueryStats():
+    """ Return the query timing statistics (one row per distinct query) and
+        the slow query log, for the admin screen. """
+
+    stats = sql.pool.queryStats
+    return stats.report(), stats.slowLog()
+
+#-------------------------------------------------------------------------------
+
+def resetQueryStats():
+    """ Clear the query timing statistics and the slow query log, and the
+        query cache counters. """
+
+    sql.pool.queryStats.reset()
+    sql.pool.queryCache.reset()
+
+#-------------------------------------------------------------------------------
+
+def getCacheStats():
+    """ Return the query cache counters (a dictionary), for the admin screen. """
+
+    return sql.pool.queryCache.stats()
+
+#-------------------------------------------------------------------------------
+
 def updateUserAuth(username):
     """ Update the Admin column for the specified user. If it's currently set
         to 'n', change to 'y', and vice versa. """
 
-    sql.query = 'Select Admin From Users Where Username = ?; '
-    sql.values = [username]
-    ret = sql.GetSQLData()
+    query = 'Select Admin From Users Where Username = ?; '
+    ret = sql.fetch(query, [username])
 
     newval = ''
     if ret[1][0] == 'n': newval = 'y'
     else: newval = 'n'
 
-    sql.query = 'Update Users Set Admin = ? Where Username = ?; '
-    sql.values = [newval, username]
-    ret = sql.UpdateSQLData()
+    query = 'Update Users Set Admin = ? Where Username = ?; '
+    ret = sql.execute(query, [newval, username])
 
 #-------------------------------------------------------------------------------
 
@@ -136,10 +341,9 @@ def getUser(username, password):
 
     msg = 'Error - Username and/or Password not found - Please retry'
 
-    sql.query = 'Select Username, PasswordHash, Email, Admin From Users '
-    sql.query += 'Where Username = ?; '
-    sql.values = [username]
-    ret = sql.GetSQLData()
+    query = 'Select Username, PasswordHash, Email, Admin From Users '
+    query += 'Where Username = ?; '
+    ret = sql.fetch(query, [username])
     if len(ret) < 2:
         return msg
 
@@ -156,25 +360,23 @@ def storeUser(username, email, password):
     msg = ''
 
     # check if username or email already in use - reject if it is.
-    sql.query = 'Select Username From Users Where Username = ?;'
-    sql.values = [username]
-    ret = sql.GetSQLData()
+    query = 'Select Username From Users Where Username = ?;'
+    ret = sql.fetch(query, [username])
     if len(ret) > 1:
         msg += 'Error - supplied username already exists'
         return msg
 
-    sql.query = 'Select Email From Users Where Email = ?;'
-    sql.values = [email]
-    ret = sql.GetSQLData()
+    query = 'Select Email From Users Where Email = ?;'
+    ret = sql.fetch(query, [email])
     if len(ret) > 1:
         msg += 'Error - supplied email already exists'
         return msg
 
     # OK so far - store the new user on the database.
-    sql.query = 'Insert Into Users (Username, Email, PasswordHash, Admin)'
-    sql.query += 'Values (?, ?, ?, ?); '
-    sql.values = [username, email, generate_password_hash(password), 'n']
-    ret = sql.UpdateSQLData()
+    query = 'Insert Into Users (Username, Email, PasswordHash, Admin)'
+    query += 'Values (?, ?, ?, ?); '
+    ret = sql.execute(query, [username, email,
+                              generate_password_hash(password), 'n'])
 
     if isinstance(ret, int):
         return ''
@@ -196,9 +398,18 @@ def checkPassword(password, passwordhash):
 def getLocations():
     """ Return a list of location names. """
 
-    sql.query = 'Select LocationName From Location Order By LocationName; '
-    sql.values = []
-    ret = sql.GetSQLData()
+    query = 'Select LocationName From Location Order By LocationName; '
+    ret = sql.fetch(query, cached=True)
+    return ret[1:]
+
+#-------------------------------------------------------------------------------
+
+def getLocationDets():
+    """ Return a list of [name, latitude, longitude] for every location. """
+
+    query = 'Select LocationName, Latitude, Longitude From Location '
+    query += 'Order By LocationName; '
+    ret = sql.fetch(query, cached=True)
     return ret[1:]
 
 #-------------------------------------------------------------------------------
@@ -206,10 +417,9 @@ def getLocations():
 def getLatLon(location):
     """ Get the latitude and longitude for the specified UK location. """
 
-    sql.query = 'Select Latitude, Longitude From Location Where '
-    sql.query += 'LocationName = ?; '
-    sql.values = [location]
-    ret = sql.GetSQLData()
+    query = 'Select Latitude, Longitude From Location Where '
+    query += 'LocationName = ?; '
+    ret = sql.fetch(query, [location])
     return ret[1:]
 
 #-------------------------------------------------------------------------------
@@ -295,57 +505,117 @@ def reformat(data):
 
 #-------------------------------------------------------------------------------
 
-def getDayLength(start, end):
-    """ Calculate the interval between the provided start and end times, as a
-        decimal hour value. They will be strings in the format '09:35 PM' """
+# The WeatherHistory columns, and where each is found in the 'current' data
+WEATHER_COLUMNS = {'TempC': 'temp_c', 'FeelsLikeC': 'feelslike_c',
+                   'DewPointC': 'dewpoint_c', 'Humidity': 'humidity',
+                   'PressureMb': 'pressure_mb', 'PrecipMm': 'precip_mm',
+                   'WindKph': 'wind_kph', 'GustKph': 'gust_kph',
+                   'Cloud': 'cloud', 'VisKm': 'vis_km', 'Uv': 'uv'}
 
-    # Convert to 24hr format
-    start = start.replace(' ', '')
-    start = datetime.strptime(start, '%I:%M%p').strftime('%H:%M')
-    end = end.replace(' ', '')
-    end = datetime.strptime(end, '%I:%M%p').strftime('%H:%M')
+def saveWeather(lat, lon, part, data):
+    """ Record an observation from the Weather API (the 'current' part of
+        the data) in WeatherHistory, for the location at lat, lon. Called by
+        the WeatherCache after each API call. The same observation is only
+        recorded once. """
 
-    # Get the difference
-    tdelta = datetime.strptime(end, '%H:%M') - datetime.strptime(start, '%H:%M')
-    hours = (tdelta.seconds/3600)
-
-    return str(round(hours, 2))
+    if part != 'current':
+        return ''
+    current = data['current']
+    columns = ', '.join(WEATHER_COLUMNS)
+    query = f'Insert Or Ignore Into WeatherHistory (LocationName, ObservedAt, '
+    query += f'{columns}) Select LocationName, ?, '
+    query += ', '.join('?' * len(WEATHER_COLUMNS))
+    query += ' From Location Where Latitude = ? And Longitude = ?; '
+    values = [current.get('last_updated_epoch') or
+              int(datetime.now().timestamp())]
+    values += [current.get(key) for key in WEATHER_COLUMNS.values()]
+    values += [lat, lon]
+    return sql.execute(query, values)
 
 #-------------------------------------------------------------------------------
 
-def calcWetBulb(tempC, humidity):
-    """ Calculate the wet bulb temperature in both centigrade and farenheit.
-        Return the values rounded to 2 decimal places. Input parameters
-        are float values. """
-
-    a = tempC * math.atan(0.151977 * (humidity + 8.313659) ** 0.5)
-    b = math.atan(tempC + humidity) - math.atan(humidity - 1.676331)
-    c = 0.00391838 * humidity ** (1.5) * math.atan(0.023101 * humidity)
-    d = -4.686035
-    wetbulbC = a + b + c + d
+def getWeatherSeries(location, bucket='hour', start=None, end=None):
+    """ Return the WeatherHistory for a location averaged over each 'hour' or
+        'day' (UTC) - between the unix times start and end, if given - as a
+        dictionary of NumPy arrays, one value for each hour/day with any
+        observations : 'Time' (the start of the hour/day), 'Count' (number of
+        observations), the mean of each WEATHER_COLUMNS column, 'TempMinC' and
+        'TempMaxC', and 'WetBulbC' (the mean of each observation's wet bulb
+        temperature). Missing values are ignored (NaN if all are missing). """
+
+    seconds = {'hour': 3600, 'day': 86400}[bucket]
+    columns = list(WEATHER_COLUMNS)
+    query = f'Select ObservedAt, {", ".join(columns)} From WeatherHistory '
+    query += 'Where LocationName = ? And ObservedAt Between ? And ? '
+    query += 'Order By ObservedAt; '
+    values = [location, start or 0, end or 2 ** 62]
+    ret = sql.fetch(query, values, native=True)
+    if isinstance(ret, str):
+        return ret
 
-    # First is Centigrade, second is Farenheit
-    return str(round(wetbulbC, 2)), str(round((wetbulbC * 1.8 + 32), 2))
+    names = ['Time', 'Count'] + columns + ['WetBulbC', 'TempMinC', 'TempMaxC']
+    if not ret[1]:
+        return {name: np.empty(0) for name in names}
+
+    # One row per observation - None becomes NaN
+    data = np.array(ret[1], dtype=float)
+    times = data[:, 0].astype(np.int64)
+    values = data[:, 1:]
+    temp = values[:, columns.index('TempC')]
+    wetC = wetBulbArray(temp, values[:, columns.index('Humidity')])[0]
+    values = np.column_stack([values, wetC])
+
+    # The rows are in time order, so each bucket is a run of rows
+    keys = times // seconds
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    present = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (np.add.reduceat(np.where(present, values, 0), starts) /
+                 np.add.reduceat(present, starts))
+        tempMin = np.fmin.reduceat(temp, starts)
+        tempMax = np.fmax.reduceat(temp, starts)
+
+    res = {'Time': keys[starts] * seconds,
+           'Count': np.diff(np.r_[starts, len(keys)])}
+    for i, name in enumerate(columns + ['WetBulbC']):
+        res[name] = means[:, i]
+    res['TempMinC'] = tempMin
+    res['TempMaxC'] = tempMax
+    return res
 
 #-------------------------------------------------------------------------------
 
+# The last result of getTables, with the database data_version it was read at
+_tableCache = (None, [])
+
 def getTables():
     """ Get schema details for Tables, returning table names and row counts.
         Exclude the sqlite system table and any tables with 'backup' in the
-        name. """
+        name. The row counts come from the TableStats table (kept up to date
+        by triggers), and the result is cached until the database changes. """
 
-    tables = []
-    ret = sql.getTables()
+    global _tableCache
+    version = sql.dataVersion()
+    if _tableCache[0] is not None and _tableCache[0] == version:
+        return [list(table) for table in _tableCache[1]]
 
-    for table in ret[1:]:
-        sql.query = 'Select count(*) From ' + table[0] + '; '
-        sql.values = []
-        tot = sql.GetSQLData()
-        if (not table[0].startswith('sqlite') and
-            table[0].lower().count('backup') < 1):
-            tables.append([table[0], tot[1][0]])
+    query = 'Select m.tbl_name, t.RowCount From sqlite_master m '
+    query += 'Left Join TableStats t On t.TableName = m.tbl_name '
+    query += 'Where m.type = ? Order By m.tbl_name; '
+    cols, ret = sql.fetch(query, ['table'], native=True)
 
-    return tables
+    tables = []
+    for name, count in ret:
+        if (name.startswith('sqlite') or name.lower().count('backup') > 0):
+            continue
+        # Any table created without the TableStats triggers is counted
+        if count is None:
+            query = 'Select count(*) From "' + name.replace('"', '""') + '"; '
+            count = sql.fetch(query, native=True)[1][0][0]
+        tables.append([name, str(count)])
+
+    _tableCache = (version, tables)
+    return [list(table) for table in tables]
 
 #-------------------------------------------------------------------------------
 
@@ -359,24 +629,269 @@ def getViews():
 
 #-------------------------------------------------------------------------------
 
-def getTableDets(name, option):
-    """ Return either the columns in the table (option='table') or the first 15
-        rows of data from the table (option='rows').  """
+def refreshPriceHistory():
+    """ Bring the PriceHistory table up to date, adding a row for each order
+        line whose cost differs from the item's cost on its previous order
+        (using the LAG window function). Only orders after the last one
+        processed are read, together with each of their items' last earlier
+        order line - unless the triggers have flagged that older order lines
+        were changed, in which case the table is rebuilt from scratch.
+        Return the number of price changes added. """
+
+    def state():
+        query = 'Select s.LastOrderId, s.Rebuild, '
+        query += '(Select coalesce(max(OrderId), 0) From OrderItems) '
+        query += 'From PriceHistoryState s; '
+        cols, ret = sql.fetch(query, native=True)
+        return ret[0]
+
+    # Check without the write lock first - usually there is nothing to do
+    mark, rebuild, lastId = state()
+    if not rebuild and lastId <= mark:
+        return 0
+
+    with sql.transaction():
+        # And again now that the lock is held, in case another thread or
+        # process has just done it
+        mark, rebuild, lastId = state()
+        if not rebuild and lastId <= mark:
+            return 0
+        if rebuild:
+            sql.execute('Delete From PriceHistory; ')
+            mark = 0
+
+        query = 'Insert Into PriceHistory '
+        query += '(ItemId, OrderId, OrderDate, Cost, PrevCost) '
+        query += 'Select l.ItemId, l.OrderId, o.OrderDate, l.Cost, l.PrevCost '
+        query += 'From (Select ItemId, OrderId, Cost, Lag(Cost) Over '
+        query += '(Partition By ItemId Order By OrderId) As PrevCost '
+        query += 'From (Select ItemId, OrderId, Cost From OrderItems '
+        query += 'Where OrderId > :mark '
+        query += 'Union All '
+        # The latest order line already processed for each item in the new
+        # orders, to give the first new line something to compare with.
+        query += 'Select ItemId, max(OrderId), Cost From OrderItems '
+        query += 'Where OrderId <= :mark And ItemId In '
+        query += '(Select ItemId From OrderItems Where OrderId > :mark) '
+        query += 'Group By ItemId)) l '
+        query += 'Inner Join Orders o On o.OrderId = l.OrderId '
+        query += 'Where l.OrderId > :mark And l.Cost != l.PrevCost; '
+        added = sql.execute(query, {'mark': mark}, rowcount=True)
+
+        query = 'Update PriceHistoryState Set LastOrderId = ?, Rebuild = 0; '
+        sql.execute(query, [lastId])
+
+    return added
+
+#-------------------------------------------------------------------------------
+
+def getPriceChanges(itemId=None, startDate=None, endDate=None):
+    """ Return the price changes for one item (or all items), optionally
+        limited to a date range, oldest first. Each row is (OrderDate, ItemId,
+        ItemDesc, PrevCost, Cost), with the costs as numbers. """
+
+    refreshPriceHistory()
+
+    query = 'Select ph.OrderDate, ph.ItemId, i.ItemDesc, ph.PrevCost, ph.Cost '
+    query += 'From PriceHistory ph Inner Join Item i On ph.ItemId = i.ItemId '
+    query += 'Where 1 = 1 '
+    values = []
+    if itemId is not None:
+        query += 'And ph.ItemId = ? '
+        values.append(itemId)
+    if startDate:
+        query += 'And ph.OrderDate >= ? '
+        values.append(startDate)
+    if endDate:
+        query += 'And ph.OrderDate <= ? '
+        values.append(endDate)
+    query += 'Order By ph.OrderDate, ph.ItemId; '
+    cols, ret = sql.fetch(query, values, native=True)
+    return ret
+
+#-------------------------------------------------------------------------------
+
+def refreshOrderSummary():
+    """ Rebuild the OrderSummaryData rows for every order that the triggers
+        have marked as changed (in OrderSummaryDirty). Each order gets its
+        item lines, sorted by category and item description, followed by a
+        'Total' line. Return the number of orders refreshed. """
+
+    def dirty():
+        query = 'Select count(*) From OrderSummaryDirty; '
+        cols, ret = sql.fetch(query, native=True)
+        return ret[0][0]
+
+    # Check without the write lock first - usually there is nothing to do
+    if dirty() == 0:
+        return 0
+
+    with sql.transaction():
+        # And again now that the lock is held, in case another thread or
+        # process has just done it
+        count = dirty()
+        if count == 0:
+            return 0
+
+        query = 'Delete From OrderSummaryData Where OrderKey In '
+        query += '(Select OrderId From OrderSummaryDirty); '
+        sql.execute(query)
+
+        query = 'Insert Into OrderSummaryData (OrderKey, LineNo, OrderDate, '
+        query += 'OrderDesc, Quantity, TotalCost, Cost, ItemId, ItemDesc, '
+        query += 'Food, CategoryDesc, OrderId) '
+        query += 'Select o.OrderId, Row_Number() Over (Partition By o.OrderId '
+        query += 'Order By cat.CategoryDesc, i.ItemDesc), o.OrderDate, '
+        query += 'o.OrderDesc, oi.Quantity, printf("%.2f", oi.TotalCost), '
+        query += 'printf("%.2f", oi.Cost), i.ItemId, i.ItemDesc, cat.Food, '
+        query += 'cat.CategoryDesc, o.OrderId '
+        query += 'From Orders o '
+        query += 'Inner Join OrderItems oi On o.OrderId = oi.OrderId '
+        query += 'Inner Join Item i on oi.ItemId = i.ItemId '
+        query += 'Inner Join Category cat On i.CategoryId = cat.CategoryId '
+        query += 'Where o.OrderId In (Select OrderId From OrderSummaryDirty); '
+        sql.execute(query)
+
+        # The order totals go after the item lines (LineNo can't clash)
+        query = 'Insert Into OrderSummaryData (OrderKey, LineNo, OrderDate, '
+        query += 'OrderDesc, Quantity, TotalCost, Cost, ItemId, ItemDesc, '
+        query += 'Food, CategoryDesc, OrderId) '
+        query += "Select o.OrderId, 1000000000, o.OrderDate, 'Total', "
+        query += 'Sum(oi.Quantity), printf("%.2f", Sum(oi.TotalCost)), '
+        query += "'', '', '', '', 'x', '' "
+        query += 'From Orders o '
+        query += 'Inner Join OrderItems oi On o.OrderId = oi.OrderId '
+        query += 'Where o.OrderId In (Select OrderId From OrderSummaryDirty) '
+        query += 'Group By o.OrderId; '
+        sql.execute(query)
+
+        sql.execute('Delete From OrderSummaryDirty; ')
+
+    return count
+
+#-------------------------------------------------------------------------------
+
+def getOrderSummary(startDate, endDate, after=None, pageSize=None):
+    """ Return one page of the order summary (the same columns as the
+        OrderSummary view) for orders in the date range, in date order.
+        'after' is the cursor returned with the previous page (None for the
+        first page). Returns (rows, cursor), where the cursor is None if this
+        is the last page. """
+
+    refreshOrderSummary()
+    pageSize = pageSize or app.config['PAGE_SIZE']
+
+    query = 'Select OrderDate, OrderDesc, Quantity, TotalCost, Cost, ItemId, '
+    query += 'ItemDesc, Food, CategoryDesc, OrderId, OrderKey, LineNo '
+    # With a cursor, the index range starts exactly at the cursor row
+    if after:
+        query += 'From OrderSummaryData Where OrderDate <= ? '
+        query += 'And (OrderDate, OrderKey, LineNo) > (?, ?, ?) '
+        values = [endDate] + list(after)
+    else:
+        query += 'From OrderSummaryData Where OrderDate Between ? And ? '
+        values = [startDate, endDate]
+    query += 'Order By OrderDate, OrderKey, LineNo Limit ?; '
+    values.append(pageSize + 1)
+    cols, ret = sql.fetch(query, values, native=True)
+
+    # One extra row was read, to find out if there is another page
+    cursor = None
+    if len(ret) > pageSize:
+        ret = ret[:pageSize]
+        cursor = [ret[-1][0], ret[-1][10], ret[-1][11]]
+    return [row[:10] for row in ret], cursor
+
+#-------------------------------------------------------------------------------
+
+# Views that read from a table which must be brought up to date first
+VIEW_REFRESH = {'PriceChange': refreshPriceHistory,
+                'OrderSummary': refreshOrderSummary}
+
+def refreshView(name):
+    """ Bring any table behind the named view up to date. """
+
+    if name in VIEW_REFRESH:
+        VIEW_REFRESH[name]()
+
+#-------------------------------------------------------------------------------
+
+def getTableDets(name, option, after=None, before=None, start=None,
+                 last=False):
+    """ Return either the columns in the table (option='table') or a page of
+        15 rows of data from the table (option='rows') or view (option='view').
+        The paging arguments are those of SQLClass.getTablePage - with none of
+        them the first page is returned. For rows, the page details are also
+        returned (None for option='table'), with 'total' added: the row count
+        from TableStats or the last ANALYZE, None if not known. """
 
     fmt = ''
+    page = None
 
     if option == 'table':
         ret = sql.getColumnList(name)
-    elif option == 'rows':
-        ret = sql.getTableData(name, 15)
-    elif option == 'view':
-        ret = sql.getTableData(name, 15)
-        view = sql.getViewDefinition(name)
-        fmt = formatView(view[1:][0])
+    elif option in ('rows', 'view'):
+        if option == 'view':
+            refreshView(name)
+            view = sql.getViewDefinition(name)
+            fmt = formatView(view[1:][0])
+        page = sql.getTablePage(name, 15, after, before, start, last)
+        if isinstance(page, str):
+            ret, page = page, None
+        else:
+            ret = page['rows']
+            page['total'] = getRowCount(name)
 
     # For the 'ret' result sets the first row (column names) WILL be returned.
     # The 'fmt' result is a html-formatted string (not a list).
-    return ret, fmt
+    return ret, fmt, page
+
+#-------------------------------------------------------------------------------
+
+def getRowCount(name):
+    """ Return the (approximate) row count of a table without counting it - from
+        the cached TableStats counts if it has one, else from the statistics
+        of the last ANALYZE. None if neither is known (e.g. for a view). """
+
+    for table, count in getTables():
+        if table == name:
+            return int(count)
+    return sql.approxRowCount(name)
+
+#-------------------------------------------------------------------------------
+
+def exportName(name):
+    """ Return the name of the table or view, as it is in the schema, if it
+        can be exported (one of those listed by getTables or getViews),
+        otherwise None. """
+
+    obj = sql.catalog.get(name)
+    if obj is None or obj.type not in ('table', 'view'):
+        return None
+    if obj.name.startswith('sqlite') or 'backup' in obj.name.lower():
+        return None
+    return obj.name
+
+def iterTableData(name):
+    """ Generator returning every row of the named table or view (column names
+        first), for exports. Check the name with exportName first. """
+
+    refreshView(name)
+    return sql.iterTableData(name)
+
+#-------------------------------------------------------------------------------
+
+def csvStream(rows):
+    """ Turn an iterable of rows into an iterable of CSV text lines, one line
+        at a time, so that a download never holds more than a single row. """
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
 
 #-------------------------------------------------------------------------------
 
@@ -451,29 +966,51 @@ def storeNewImages(images, pixels):
 
         mod = datetime.fromtimestamp(f.stat().st_mtime, tz=dt.timezone.utc)
         mod = mod.strftime('%d/%m/%Y %H:%M')
+        thumbs.append([str(f), mod])
+
+    # Store the details of any images not already on the database, all in a
+    # single transaction (one commit, rather than one per image).
+    query = 'Select ImageId From Image Where ImageName = ?;'
+    with sql.transaction():
+        rows, added = [], set()
+        for name, mod in thumbs:
+            if name in added: continue
+            ret = sql.fetch(query, [name])
+            if len(ret) < 2:
+                rows.append((name.replace('\\','/'), msg, mod))
+                added.add(name)
+        sql.bulkInsert('Image', ['ImageName', 'Description', 'DateAdded'], rows)
 
-        sql.query = 'Select ImageId From Image Where ImageName = ?;'
-        sql.values = [str(f)]
-        ret = sql.GetSQLData()
+#-------------------------------------------------------------------------------
 
-        if len(ret) < 2:
-            sql.query = 'Insert Into Image (ImageName, Description, DateAdded) '
-            sql.query += 'Values (?, ?, ?); '
-            sql.values = [str(f).replace('\\','/'), msg, mod]
-            ret = sql.UpdateSQLData()
+def getImageDetails(pageSize=None, after=None, before=None, start=None,
+                    last=False):
+    """ Return a list of stored image details from the database. This needs to
+        be reformatted as lists of 4 values for output to the web template.
+        With a pageSize, only that page of images is read, and the page
+        dictionary from SQLClass.fetchPage is returned, with the rows
+        reformatted (the keys are [ImageName, ImageId]). """
+
+    if pageSize is None:
+        query = 'Select ImageName, Description, DateAdded From Image '
+        query += 'Order By ImageName; '
+        ret = sql.fetch(query, cached=True)
+        fmt = imgFormat(ret[1:])
+        return fmt
+
+    page = sql.fetchPage('ImageName, Description, DateAdded', 'Image',
+                         ['ImageName', 'ImageId'], '', (), pageSize, after,
+                         before, start, last, cached=True)
+    if not isinstance(page, str):
+        page['rows'] = imgFormat(page['rows'])
+    return page
 
 #-------------------------------------------------------------------------------
 
-def getImageDetails():
-    """ Return a list of stored image details from the database. This needs to
-        be reformatted as lists of 4 values for output to the web template. """
+def getImageCount():
+    """ Return the number of stored images. """
 
-    sql.query = 'Select ImageName, Description, DateAdded From Image '
-    sql.query += 'Order By ImageName; '
-    sql.values = []
-    ret = sql.GetSQLData()
-    fmt = imgFormat(ret[1:])
-    return fmt
+    return sql.fetch('Select count(*) From Image; ', native=True)[1][0][0]
 
 #-------------------------------------------------------------------------------
 
@@ -500,6 +1037,7 @@ def populateImageTable(dir):
 
     ret = getThumbnails(dir, '640')
     msg = 'This is a new image. Please add a description.'
+    rows = []
     for thumb in ret:
         if '_thumb' in (thumb[0]):
             thumb[0] = thumb[0].replace('_thumb','')
@@ -507,11 +1045,11 @@ def populateImageTable(dir):
         f = Path(thumb[0])
         mod = datetime.fromtimestamp(f.stat().st_mtime, tz=dt.timezone.utc)
         mod = mod.strftime('%d/%m/%Y %H:%M')
+        rows.append((thumb[0], msg, mod))
 
-        sql.query = 'Insert Into Image (ImageName, Description, DateAdded) '
-        sql.query += 'Values (?, ?, ?); '
-        sql.values = [thumb[0], msg, mod]
-        ret = sql.UpdateSQLData()
+    # One executemany() call and one commit for the whole folder
+    return sql.bulkInsert('Image', ['ImageName', 'Description', 'DateAdded'],
+                          rows)
 
 #-------------------------------------------------------------------------------
 
@@ -519,9 +1057,8 @@ def deleteImage(image):
     """ Delete an image from the database. """
 
     image = image.replace('_thumb', '')
-    sql.query = 'Delete From Image Where ImageName = ?;'
-    sql.values = [image]
-    res = sql.UpdateSQLData()
+    query = 'Delete From Image Where ImageName = ?;'
+    res = sql.execute(query, [image])
     return res
 
 #-------------------------------------------------------------------------------
@@ -529,10 +1066,9 @@ def deleteImage(image):
 def getImageByName(name):
     """ Get the requested image details (matching on name). """
 
-    sql.query = 'Select ImageName, Description, DateAdded From Image '
-    sql.query += 'Where ImageName = ?; '
-    sql.values = [name]
-    ret = sql.GetSQLData()
+    query = 'Select ImageName, Description, DateAdded From Image '
+    query += 'Where ImageName = ?; '
+    ret = sql.fetch(query, [name])
     return ret[1:]
 
 #-------------------------------------------------------------------------------
@@ -543,10 +1079,9 @@ def updateImage(oldname, name, desc):
     new = name.replace('\\', '/')
     #print(f'old : {old}')
     print(f'new : {new}')
-    sql.query = 'Update Image Set ImageName = ?, Description = ? '
-    sql.query += 'Where ImageName = ?; '
-    sql.values = [new, desc, oldname]
-    ret = sql.UpdateSQLData()
+    query = 'Update Image Set ImageName = ?, Description = ? '
+    query += 'Where ImageName = ?; '
+    ret = sql.execute(query, [new, desc, oldname])
     return ret
 
 #-------------------------------------------------------------------------------
@@ -558,6 +1093,7 @@ def storeAudio(tracks):
               passed as a Windows path (with '\' separators). They need to
               be changed to '/', then all is well. """
 
+    rows = []
     for track in tracks:
         track = track.replace('\\', '/')
         tag = TinyTag.get(track)
@@ -565,23 +1101,38 @@ def storeAudio(tracks):
         minutes = int(tag.duration / 60)
         seconds = int(tag.duration - minutes * 60)
         trackLength = f'{minutes}:{seconds}'
+        rows.append((track, tag.title, tag.artist, tag.album, tag.year,
+                     trackLength))
 
-        sql.query = 'Insert Into Music (Filename, Title, Artist, Album, Year, '
-        sql.query += 'Duration) Values (?, ?, ?, ?, ?, ?); '
-        sql.values = [track, tag.title, tag.artist, tag.album, tag.year,
-                      trackLength]
-        ret = sql.UpdateSQLData()
+    # One executemany() call and one commit for all of the tracks
+    cols = ['Filename', 'Title', 'Artist', 'Album', 'Year', 'Duration']
+    return sql.bulkInsert('Music', cols, rows)
 
 #-------------------------------------------------------------------------------
 
-def getAudio():
-    """ Return a list of all music details. """
+def getAudio(pageSize=None, after=None, before=None, start=None, last=False):
+    """ Return a list of all music details. With a pageSize, only that page of
+        tracks is read, and the page dictionary from SQLClass.fetchPage is
+        returned. The keys are [Title, MusicId], with a missing Title as ''
+        (to match the Music_Title index). """
 
-    sql.query = 'Select Filename, Title, Artist, Album, Year, Duration '
-    sql.query += 'From Music Order By Title; '
-    sql.values = []
-    ret = sql.GetSQLData()
-    return ret[1:]
+    if pageSize is None:
+        query = 'Select Filename, Title, Artist, Album, Year, Duration '
+        query += 'From Music Order By Title; '
+        ret = sql.fetch(query, cached=True)
+        return ret[1:]
+
+    columns = 'Filename, Title, Artist, Album, Year, Duration'
+    keys = ["ifnull(Title, '') Collate NoCase", 'MusicId']
+    return sql.fetchPage(columns, 'Music', keys, '', (), pageSize, after,
+                         before, start, last, cached=True)
+
+#-------------------------------------------------------------------------------
+
+def getAudioCount():
+    """ Return the number of music tracks. """
+
+    return sql.fetch('Select count(*) From Music; ', native=True)[1][0][0]
 
 #-------------------------------------------------------------------------------
 
@@ -589,9 +1140,8 @@ def deleteAudio(fname):
     """ Delete the details of the requested audio file from the database,
         matching on the music track file name. """
 
-    sql.query = 'Delete From Music Where Filename = ?; '
-    sql.values = [fname]
-    ret = sql.UpdateSQLData()
+    query = 'Delete From Music Where Filename = ?; '
+    ret = sql.execute(query, [fname])
     return ret
 
 #-------------------------------------------------------------------------------
@@ -612,15 +1162,13 @@ def storeVideo(data, locn, source):
         dat = datetime.fromtimestamp(f.stat().st_mtime, tz=dt.timezone.utc)
         dat = dat.strftime('%d/%m/%Y %H:%M')
 
-    sql.query = 'Select VideoId From Video Where Key = ?; '
-    sql.values = [locn]
-    ret = sql.GetSQLData()
+    query = 'Select VideoId From Video Where Key = ?; '
+    ret = sql.fetch(query, [locn])
     if len(ret) > 1: return ret
 
-    sql.query = 'Insert Into Video (Key, Title, VideoDate, VideoType) Values '
-    sql.query += '(?, ?, ?, ?); '
-    sql.values = [locn, title, dat, source]
-    ret = sql.UpdateSQLData()
+    query = 'Insert Into Video (Key, Title, VideoDate, VideoType) Values '
+    query += '(?, ?, ?, ?); '
+    ret = sql.execute(query, [locn, title, dat, source])
     return ret
 
 #-------------------------------------------------------------------------------
@@ -628,10 +1176,9 @@ def storeVideo(data, locn, source):
 def getVideo():
     """ Get the video details from the database. """
 
-    sql.query = 'Select Key, Title, VideoDate, VideoType From Video '
-    sql.query += 'Order By Title; '
-    sql.values = []
-    ret = sql.GetSQLData()
+    query = 'Select Key, Title, VideoDate, VideoType From Video '
+    query += 'Order By Title; '
+    ret = sql.fetch(query, cached=True)
     return ret[1:]
 
 #-------------------------------------------------------------------------------
@@ -639,11 +1186,22 @@ def getVideo():
 def deleteVideo(key):
     """ Delete the requested video from the database. """
 
-    sql.query = 'Delete From Video Where Key = ?; '
-    sql.values = [key]
-    ret = sql.UpdateSQLData()
+    query = 'Delete From Video Where Key = ?; '
+    ret = sql.execute(query, [key])
     return ret
 
+#-------------------------------------------------------------------------------
+# The paged listings - the routes call their page() method. The row counts are
+# cached until the database changes (PRAGMA data_version).
+#-------------------------------------------------------------------------------
+
+orderPages = Paginator(getOrders, getOrderCount, sql.dataVersion,
+                       app.config['PAGE_SIZE'])
+musicPages = Paginator(getAudio, getAudioCount, sql.dataVersion,
+                       app.config['MUSIC_PAGE_SIZE'])
+imagePages = Paginator(getImageDetails, getImageCount, sql.dataVersion,
+                       app.config['IMAGE_PAGE_SIZE'])
+
 #-------------------------------------------------------------------------------
 
 def main():
@@ -0,0 +1,412 @@
+"""
+ Name:          migrations.py
+
+ Purpose:       Versioned schema changes for the website database. Each entry
+                in MIGRATIONS is a tuple of (version, description, steps),
+                where the steps are SQL statements (or functions taking the
+                database connection). They are applied in order at startup by
+                SQLClass.migrate(), called from dbAccess, and the version
+                reached is recorded in the database's PRAGMA user_version.
+
+                Never change a migration once it has been released - add a
+                new one with the next version number instead.
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+from orders_app.SQLiteDatabase import quoteName
+
+#-------------------------------------------------------------------------------
+# Version 1 - secondary indexes for the lookups and joins used by dbAccess.
+#   Orders.OrderDate      getOrders (date range), in OrderDate, OrderId order
+#   Image.ImageName       storeNewImages, getImageByName, updateImage, etc.
+#   Music.Filename        deleteAudio
+#   Video.Key             storeVideo, deleteVideo
+#   OrderItems.ItemId     the item/category joins. Quantity and TotalCost are
+#                         included so that getCatCounts and getItemCosts can
+#                         be answered from the index alone (covering index).
+#   Item.CategoryId       the category join
+# ANALYZE then gives the query planner statistics for the new indexes.
+#-------------------------------------------------------------------------------
+
+V1_INDEXES = [
+    'Create Index If Not Exists Orders_OrderDate On Orders (OrderDate);',
+    'Create Index If Not Exists Image_ImageName On Image (ImageName);',
+    'Create Index If Not Exists Music_Filename On Music (Filename);',
+    'Create Index If Not Exists Video_Key On Video (Key);',
+    'Create Index If Not Exists OrderItems_ItemId On OrderItems '
+        '(ItemId, Quantity, TotalCost);',
+    'Create Index If Not Exists Item_CategoryId On Item (CategoryId);',
+    'Analyze;',
+]
+
+#-------------------------------------------------------------------------------
+# Version 2 - rollup tables for the dashboard (getCatCounts, getItemCosts).
+#   ItemTotals       order lines, quantity and total cost per item
+#   CategoryTotals   order lines and quantity per category
+# Triggers on OrderItems keep both up to date as order lines are inserted,
+# updated or deleted, and triggers on Item move an item's totals when its
+# category is changed or it is deleted. Rows are left in place (with zero
+# lines) when the last order line goes, so readers filter on Lines > 0.
+#-------------------------------------------------------------------------------
+
+V2_ROLLUPS = [
+    """Create Table ItemTotals (
+        ItemId integer Primary Key Not NULL,
+        Lines integer Not NULL Default 0,
+        Quantity integer Not NULL Default 0,
+        TotalCost real Not NULL Default 0
+    );""",
+    'Create Index ItemTotals_TotalCost On ItemTotals (TotalCost);',
+    """Create Table CategoryTotals (
+        CategoryId integer Primary Key Not NULL,
+        Lines integer Not NULL Default 0,
+        Quantity integer Not NULL Default 0
+    );""",
+
+    # Initial totals from the existing order history
+    """Insert Into ItemTotals (ItemId, Lines, Quantity, TotalCost)
+       Select ItemId, count(*), coalesce(sum(Quantity), 0),
+              coalesce(sum(TotalCost), 0)
+       From OrderItems Group By ItemId;""",
+    """Insert Into CategoryTotals (CategoryId, Lines, Quantity)
+       Select i.CategoryId, sum(t.Lines), sum(t.Quantity)
+       From ItemTotals t Inner Join Item i On t.ItemId = i.ItemId
+       Where i.CategoryId Is Not NULL Group By i.CategoryId;""",
+
+    """Create Trigger OrderItems_Totals_Insert After Insert On OrderItems
+       Begin
+           Insert Into ItemTotals (ItemId, Lines, Quantity, TotalCost)
+           Values (new.ItemId, 1, coalesce(new.Quantity, 0),
+                   coalesce(new.TotalCost, 0))
+           On Conflict (ItemId) Do Update Set
+               Lines = Lines + 1,
+               Quantity = Quantity + excluded.Quantity,
+               TotalCost = TotalCost + excluded.TotalCost;
+           Insert Into CategoryTotals (CategoryId, Lines, Quantity)
+           Select CategoryId, 1, coalesce(new.Quantity, 0) From Item
+           Where ItemId = new.ItemId And CategoryId Is Not NULL
+           On Conflict (CategoryId) Do Update Set
+               Lines = Lines + 1,
+               Quantity = Quantity + excluded.Quantity;
+       End;""",
+
+    """Create Trigger OrderItems_Totals_Delete After Delete On OrderItems
+       Begin
+           Update ItemTotals Set
+               Lines = Lines - 1,
+               Quantity = Quantity - coalesce(old.Quantity, 0),
+               TotalCost = TotalCost - coalesce(old.TotalCost, 0)
+           Where ItemId = old.ItemId;
+           Update CategoryTotals Set
+               Lines = Lines - 1,
+               Quantity = Quantity - coalesce(old.Quantity, 0)
+           Where CategoryId = (Select CategoryId From Item
+                               Where ItemId = old.ItemId);
+       End;""",
+
+    """Create Trigger OrderItems_Totals_Update
+       After Update Of ItemId, Quantity, TotalCost On OrderItems
+       Begin
+           Update ItemTotals Set
+               Lines = Lines - 1,
+               Quantity = Quantity - coalesce(old.Quantity, 0),
+               TotalCost = TotalCost - coalesce(old.TotalCost, 0)
+           Where ItemId = old.ItemId;
+           Update CategoryTotals Set
+               Lines = Lines - 1,
+               Quantity = Quantity - coalesce(old.Quantity, 0)
+           Where CategoryId = (Select CategoryId From Item
+                               Where ItemId = old.ItemId);
+           Insert Into ItemTotals (ItemId, Lines, Quantity, TotalCost)
+           Values (new.ItemId, 1, coalesce(new.Quantity, 0),
+                   coalesce(new.TotalCost, 0))
+           On Conflict (ItemId) Do Update Set
+               Lines = Lines + 1,
+               Quantity = Quantity + excluded.Quantity,
+               TotalCost = TotalCost + excluded.TotalCost;
+           Insert Into CategoryTotals (CategoryId, Lines, Quantity)
+           Select CategoryId, 1, coalesce(new.Quantity, 0) From Item
+           Where ItemId = new.ItemId And CategoryId Is Not NULL
+           On Conflict (CategoryId) Do Update Set
+               Lines = Lines + 1,
+               Quantity = Quantity + excluded.Quantity;
+       End;""",
+
+    """Create Trigger Item_Totals_Category After Update Of CategoryId On Item
+       When old.CategoryId Is Not new.CategoryId
+       Begin
+           Update CategoryTotals Set
+               Lines = Lines - (Select Lines From ItemTotals
+                                Where ItemId = old.ItemId),
+               Quantity = Quantity - (Select Quantity From ItemTotals
+                                      Where ItemId = old.ItemId)
+           Where CategoryId = old.CategoryId
+           And Exists (Select 1 From ItemTotals Where ItemId = old.ItemId);
+           Insert Into CategoryTotals (CategoryId, Lines, Quantity)
+           Select new.CategoryId, Lines, Quantity From ItemTotals
+           Where ItemId = new.ItemId And new.CategoryId Is Not NULL
+           On Conflict (CategoryId) Do Update Set
+               Lines = Lines + excluded.Lines,
+               Quantity = Quantity + excluded.Quantity;
+       End;""",
+
+    """Create Trigger Item_Totals_Delete After Delete On Item
+       Begin
+           Update CategoryTotals Set
+               Lines = Lines - (Select Lines From ItemTotals
+                                Where ItemId = old.ItemId),
+               Quantity = Quantity - (Select Quantity From ItemTotals
+                                      Where ItemId = old.ItemId)
+           Where CategoryId = old.CategoryId
+           And Exists (Select 1 From ItemTotals Where ItemId = old.ItemId);
+       End;""",
+]
+
+#-------------------------------------------------------------------------------
+# Version 3 - price history, replacing the PriceChange view's correlated
+# subquery. PriceHistory holds one row per order line whose Cost differs from
+# the same item's cost on its previous order (found with the LAG window
+# function). It is filled by dbAccess.refreshPriceHistory, which only looks at
+# orders after PriceHistoryState.LastOrderId. Triggers ask for a full rebuild
+# (Rebuild = 1) if order lines at or before that point are changed. The
+# PriceChange view now just reads the table.
+#-------------------------------------------------------------------------------
+
+V3_PRICE_HISTORY = [
+    """Create Table PriceHistory (
+        ItemId integer Not NULL,
+        OrderId integer Not NULL,
+        OrderDate datetime NULL,
+        Cost numeric(6,2) NULL,
+        PrevCost numeric(6,2) NULL,
+        Primary Key (ItemId, OrderId)
+    ) Without Rowid;""",
+    'Create Index PriceHistory_OrderDate On PriceHistory (OrderDate);',
+    """Create Table PriceHistoryState (
+        Id integer Primary Key Check (Id = 1),
+        LastOrderId integer Not NULL Default 0,
+        Rebuild integer Not NULL Default 1
+    );""",
+    'Insert Into PriceHistoryState (Id, LastOrderId, Rebuild) Values (1, 0, 1);',
+
+    # Each item's order lines in OrderId order, for the window function and
+    # for finding an item's previous cost.
+    'Create Index OrderItems_ItemId_OrderId On OrderItems (ItemId, OrderId, Cost);',
+
+    """Create Trigger OrderItems_Price_Insert After Insert On OrderItems
+       When new.OrderId <= (Select LastOrderId From PriceHistoryState)
+       Begin
+           Update PriceHistoryState Set Rebuild = 1;
+       End;""",
+    """Create Trigger OrderItems_Price_Delete After Delete On OrderItems
+       When old.OrderId <= (Select LastOrderId From PriceHistoryState)
+       Begin
+           Update PriceHistoryState Set Rebuild = 1;
+       End;""",
+    """Create Trigger OrderItems_Price_Update
+       After Update Of OrderId, ItemId, Cost On OrderItems
+       When old.OrderId <= (Select LastOrderId From PriceHistoryState)
+         Or new.OrderId <= (Select LastOrderId From PriceHistoryState)
+       Begin
+           Update PriceHistoryState Set Rebuild = 1;
+       End;""",
+    """Create Trigger Orders_Price_Date After Update Of OrderDate On Orders
+       Begin
+           Update PriceHistory Set OrderDate = new.OrderDate
+           Where OrderId = new.OrderId;
+       End;""",
+    """Create Trigger Orders_Price_Delete After Delete On Orders
+       Begin
+           Delete From PriceHistory Where OrderId = old.OrderId;
+       End;""",
+
+    'Drop View If Exists PriceChange;',
+    """Create View PriceChange
+       As
+       Select ItemId, OrderDate, Cost, PrevCost, OrderId
+       From PriceHistory
+       Order By OrderDate;""",
+]
+
+#-------------------------------------------------------------------------------
+# Version 4 - materialised order summary, replacing the OrderSummary view's
+# four-table join, UNION and sort. OrderSummaryData holds the same rows as the
+# old view (item lines, then a 'Total' line for each order), with OrderKey and
+# LineNo columns giving their display order. Triggers put the OrderId of any
+# order affected by a change into OrderSummaryDirty, and
+# dbAccess.refreshOrderSummary rebuilds just those orders' rows.
+#-------------------------------------------------------------------------------
+
+V4_ORDER_SUMMARY = [
+    """Create Table OrderSummaryData (
+        OrderKey integer Not NULL,
+        LineNo integer Not NULL,
+        OrderDate datetime NULL,
+        OrderDesc varchar(100) NULL,
+        Quantity integer NULL,
+        TotalCost text NULL,
+        Cost text NULL,
+        ItemId integer NULL,
+        ItemDesc varchar(100) NULL,
+        Food char(1) NULL,
+        CategoryDesc varchar(100) NULL,
+        OrderId integer NULL,
+        Primary Key (OrderKey, LineNo)
+    ) Without Rowid;""",
+    """Create Index OrderSummaryData_OrderDate
+       On OrderSummaryData (OrderDate, OrderKey, LineNo);""",
+    'Create Table OrderSummaryDirty (OrderId integer Primary Key Not NULL);',
+
+    # Every existing order needs building on the first refresh
+    'Insert Into OrderSummaryDirty (OrderId) Select OrderId From Orders;',
+
+    """Create Trigger OrderItems_Summary_Insert After Insert On OrderItems
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty Values (new.OrderId);
+       End;""",
+    """Create Trigger OrderItems_Summary_Delete After Delete On OrderItems
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty Values (old.OrderId);
+       End;""",
+    """Create Trigger OrderItems_Summary_Update After Update On OrderItems
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty Values (old.OrderId);
+           Insert Or Ignore Into OrderSummaryDirty Values (new.OrderId);
+       End;""",
+    """Create Trigger Orders_Summary_Update
+       After Update Of OrderDate, OrderDesc On Orders
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty Values (new.OrderId);
+       End;""",
+    """Create Trigger Orders_Summary_Delete After Delete On Orders
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty Values (old.OrderId);
+       End;""",
+    """Create Trigger Item_Summary_Update
+       After Update Of ItemDesc, CategoryId On Item
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty
+           Select OrderId From OrderItems Where ItemId = new.ItemId;
+       End;""",
+    """Create Trigger Category_Summary_Update
+       After Update Of Food, CategoryDesc On Category
+       Begin
+           Insert Or Ignore Into OrderSummaryDirty
+           Select oi.OrderId From Item i
+           Inner Join OrderItems oi On oi.ItemId = i.ItemId
+           Where i.CategoryId = new.CategoryId;
+       End;""",
+
+    'Drop View If Exists OrderSummary;',
+    """Create View OrderSummary
+       As
+       Select OrderDate, OrderDesc, Quantity, TotalCost, Cost, ItemId,
+              ItemDesc, Food, CategoryDesc, OrderId
+       From OrderSummaryData
+       Order By OrderDate, OrderKey, LineNo;""",
+]
+
+#-------------------------------------------------------------------------------
+# Version 5 - row counts for the schema browser (dbAccess.getTables). The
+# TableStats table holds the row count of every table, kept up to date by an
+# insert and a delete trigger on each table, so it no longer counts the rows
+# of every table on each visit. Any later migration that creates a table
+# should call addTableStats for it.
+# NOTE: 'Insert Or Replace' deletes rows without firing delete triggers, so
+#       it must not be used on these tables.
+#-------------------------------------------------------------------------------
+
+def addTableStats(conn, table):
+    """ Store the current row count of 'table' in TableStats, and create the
+        triggers that keep it up to date. """
+
+    name = quoteName(table)
+    literal = "'" + table.replace("'", "''") + "'"
+    conn.execute('Insert Or Replace Into TableStats (TableName, RowCount) '
+                 f'Select ?, count(*) From {name};', (table,))
+    for event, change in (('Insert', '+'), ('Delete', '-')):
+        trigger = quoteName(f'{table}_Stats_{event}')
+        conn.execute(f'Create Trigger If Not Exists {trigger} '
+                     f'After {event} On {name} Begin Update TableStats '
+                     f'Set RowCount = RowCount {change} 1 '
+                     f'Where TableName = {literal}; End;')
+
+def v5TableStats(conn):
+    """ Create TableStats, and the triggers for every existing table except the
+        sqlite system tables and any backup tables. """
+
+    conn.execute("""Create Table TableStats (
+                        TableName text Primary Key Not NULL,
+                        RowCount integer Not NULL Default 0
+                    ) Without Rowid;""")
+    query = "Select name From sqlite_master Where type = 'table' "
+    query += "And name Not Like 'sqlite%' And name != 'TableStats';"
+    for (table,) in conn.execute(query).fetchall():
+        if 'backup' not in table.lower():
+            addTableStats(conn, table)
+
+V5_TABLE_STATS = [v5TableStats]
+
+#-------------------------------------------------------------------------------
+# Version 6 - index for paging the music listing (dbAccess.getAudio), in Title,
+# MusicId order. Title may be NULL, which a keyset can't compare, so the key
+# (and this index) uses ifnull(Title, ''). The image listing is paged in
+# ImageName, ImageId order, which is already the Image_ImageName index.
+#-------------------------------------------------------------------------------
+
+V6_MUSIC_TITLE = [
+    "Create Index If Not Exists Music_Title On Music "
+        "(ifnull(Title, '') Collate NoCase);",
+]
+
+#-------------------------------------------------------------------------------
+# Version 7 - WeatherHistory, every observation fetched from the Weather API
+# (dbAccess.saveWeather), for the trend series of dbAccess.getWeatherSeries.
+# One row per location and observation time (the API's last_updated_epoch,
+# in unix seconds), so fetching the same observation again adds nothing.
+# Without Rowid, as the rows are always read by location and time range.
+#-------------------------------------------------------------------------------
+
+def v7WeatherHistory(conn):
+    """ Create WeatherHistory, with its TableStats triggers. """
+
+    conn.execute("""Create Table WeatherHistory (
+                        LocationName text Not NULL,
+                        ObservedAt integer Not NULL,
+                        TempC real,
+                        FeelsLikeC real,
+                        DewPointC real,
+                        Humidity integer,
+                        PressureMb real,
+                        PrecipMm real,
+                        WindKph real,
+                        GustKph real,
+                        Cloud integer,
+                        VisKm real,
+                        Uv real,
+                        Primary Key (LocationName, ObservedAt)
+                    ) Without Rowid;""")
+    addTableStats(conn, 'WeatherHistory')
+
+V7_WEATHER_HISTORY = [v7WeatherHistory]
+
+#-------------------------------------------------------------------------------
+
+MIGRATIONS = [
+    (1, 'Add indexes for lookups, joins and dashboard aggregates', V1_INDEXES),
+    (2, 'Add trigger-maintained dashboard rollup tables', V2_ROLLUPS),
+    (3, 'Replace the PriceChange view with the PriceHistory table',
+        V3_PRICE_HISTORY),
+    (4, 'Replace the OrderSummary view with the OrderSummaryData table',
+        V4_ORDER_SUMMARY),
+    (5, 'Add trigger-maintained table row counts', V5_TABLE_STATS),
+    (6, 'Add an index for paging the music listing', V6_MUSIC_TITLE),
+    (7, 'Add the WeatherHistory table', V7_WEATHER_HISTORY),
+]
+
+#-------------------------------------------------------------------------------
@@ -0,0 +1,103 @@
+"""
+ Name:          paginator.py
+
+ Purpose:       Paging for the listing screens (orders, music and images).
+                Each listing is a Paginator object, created in dbAccess with
+                the function that reads one page of it from the database (with
+                a keyset, see SQLClass.fetchPage) and the function that counts
+                its rows. Only the page being shown is ever read, and the row
+                counts are cached (for each filter, e.g. date range) until the
+                database changes, so the work done for each request stays the
+                same however large the tables grow.
+
+                The only thing kept for each user is a small 'cursor'
+                dictionary - the keys of the first and last rows on the page
+                and the page number - which the routes hold in the DataStore.
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+import threading
+
+class Paginator():
+    """ One paged listing. 'fetch' is called as
+            fetch(*filter, pageSize=, after=, before=, start=, last=)
+        and returns a page dictionary as SQLClass.fetchPage. 'count' is called
+        as count(*filter), and returns the number of rows. 'version' returns
+        a value that changes whenever the data does (PRAGMA data_version). """
+
+    def __init__(self, fetch, count, version, pageSize=15):
+
+        self.fetch = fetch
+        self.count = count
+        self.version = version
+        self.pageSize = pageSize
+        self.__counts = {}
+        self.__countsVersion = None
+        self.__lock = threading.Lock()
+
+#-------------------------------------------------------------------------------
+
+    def getCount(self, *filter):
+        """ Return the number of rows for the filter, cached until the data
+            changes. """
+
+        version = self.version()
+        with self.__lock:
+            if version != self.__countsVersion:
+                self.__counts = {}
+                self.__countsVersion = version
+            if filter in self.__counts:
+                return self.__counts[filter]
+
+        count = self.count(*filter)
+        with self.__lock:
+            if version == self.__countsVersion:
+                self.__counts[filter] = count
+        return count
+
+#-------------------------------------------------------------------------------
+
+    def page(self, cursor, command, *filter):
+        """ Return the rows for a page, and the new cursor for it. 'cursor' is
+            the one returned for the page currently shown (or None), and the
+            command is 'f'irst, 'n'ext, 'p'revious, 'l'ast or 'c'urrent (show
+            the current page again, e.g. after an update). Going past either
+            end shows the first/last page again. A different filter always
+            starts at the first page. """
+
+        cursor = cursor or {}
+        if list(filter) != cursor.get('filter'):
+            cursor, command = {}, 'f'
+
+        size = self.getCount(*filter)
+        pages = max((size + self.pageSize - 1) // self.pageSize, 1)
+
+        args, number = {}, 1
+        if command == 'n' and cursor.get('next'):
+            args['after'], number = cursor['last'], cursor['number'] + 1
+        elif command == 'p' and cursor.get('prev'):
+            args['before'], number = cursor['first'], cursor['number'] - 1
+        elif command == 'c' and cursor.get('first'):
+            args['start'], number = cursor['first'], cursor['number']
+        elif command in ('n', 'l'):
+            args['last'], number = True, pages
+
+        res = self.fetch(*filter, pageSize=self.pageSize, **args)
+        if isinstance(res, str):
+            return [], cursor
+
+        # The page being shown again may now be empty, after a delete
+        if not res['rows'] and 'start' in args:
+            res = self.fetch(*filter, pageSize=self.pageSize, last=True)
+            number = pages
+
+        cursor = {'filter': list(filter), 'page': command,
+                  'number': min(max(number, 1), pages), 'pages': pages,
+                  'size': size, 'first': res['first'], 'last': res['last'],
+                  'prev': res['prev'], 'next': res['next']}
+        return res['rows'], cursor
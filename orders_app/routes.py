@@ -22,10 +22,35 @@
                 storage. This will then be used the same as the session object,
                 substituting "session" by "ds.store".
 
+                17/10/2026
+                Add the exportorders and exporttable routes, which stream
+                query results to the browser as CSV files.
+
+                17/10/2026
+                The DataStore now keeps a separate store for each session, so
+                ds.store is the current user's data only. Logout clears just
+                that user's store; the admin screen clears them all.
+
+                17/10/2026
+                The api route gets the Weather API results through the
+                WeatherCache in weather.py, rather than calling the site
+                every time. Import jsonify, used for the api errors.
+
+                17/10/2026
+                Add the weather Prefetcher, which keeps the WeatherCache up
+                to date for every location in the background (started by
+                the first request, if WEATHER_PREFETCH_INTERVAL is set).
+
+                17/10/2026
+                Each observation fetched is saved in the WeatherHistory table
+                (dbAccess.saveWeather). Add the weatherhistory route, giving
+                the hourly or daily averages for a location as JSON.
+
 """
 #-------------------------------------------------------------------------------
 
-from flask import render_template, flash, redirect, url_for, session, request
+from flask import (render_template, flash, redirect, url_for, session, request,
+                   Response, stream_with_context, jsonify, abort)
 from orders_app import app
 
 from orders_app.forms import (LoginForm, RegisterForm, getEmailForm,
@@ -40,7 +65,11 @@ import orders_app.emailClass as ec
 email = ec.EmailClass()
 
 import orders_app.datastore as datastore
-ds = datastore.DataStore()
+ds = datastore.DataStore(app)
+import orders_app.weather as wapi
+wc = wapi.WeatherCache(app)
+wc.onFetch = db.saveWeather
+prefetch = wapi.Prefetcher(wc, db.getLocationDets, app)
 from datetime import datetime
 import time
 
@@ -81,7 +110,7 @@ def getPlot(data):
 
     for item in data:
         cat.append(item[0])
-        tot.append(int(item[1]))
+        tot.append(item[1])
 
     plt.close()
     fig = plt.Figure(figsize=(1,1))
@@ -143,43 +172,41 @@ def index():
 @login_required
 def orders(page):
 
-    rows = app.config['PAGE_SIZE']
-
-    if not ds.store.get('dict', {}):
-        ds.store['dict'] = {'page':page, 'count':rows, 'size':0}
-
-    # Store the page request in the session dict
-    ds.store['dict']['page'] = page
-
-    # Calculate the end index for the list slicing
-    if page == 'f': ds.store['dict']['count'] = rows
-    elif page == 'n': ds.store['dict']['count'] += rows
-    elif page == 'p': ds.store['dict']['count'] -= rows
-    elif page == 'l': ds.store['dict']['count'] = ds.store['dict']['size']
-
-    # Check for, and correct, out-of-range values
-    if ds.store['dict']['count'] < rows :
-        ds.store['dict']['count'] = rows
-    if (ds.store['dict']['count'] > ds.store['dict']['size'] and
-        ds.store['dict']['size'] != 0):
-        ds.store['dict']['count'] = ds.store['dict']['size']
-
     form =DateRangeForm()
     if form.validate_on_submit():
         sdate = form.startDate.data.strftime('%Y-%m-%d')
         edate = form.endDate.data.strftime('%Y-%m-%d')
-        res = db.getOrders(sdate, edate)
-        # Store the data, and number of records, returned
-        ds.store['orderdata'] = res
-        ds.store['dict']['size'] = len(res)
+        ds.store['orderdates'] = [sdate, edate]
 
-    # Do this whichever button was clicked (main or pagination)
-    count = ds.store['dict']['count']
-    ds.store['orders'] = ds.store.get('orderdata',[])[count-rows:count]
+    # Only the page being shown is read from the database. The session dict
+    # holds just the paginator's cursor for it.
+    orders = []
+    dates = ds.store.get('orderdates', [])
+    if dates:
+        orders, ds.store['dict'] = db.orderPages.page(ds.store.get('dict'),
+                                                      page, *dates)
 
     return render_template('orders.html', title='Orders', currdate=currdate,
-                            orders=ds.store.get('orders',[]), year=year,
-                            form=form, page=ds.store['dict']['page'])
+                            orders=orders, year=year, form=form, page=page,
+                            cursor=ds.store.get('dict', {}))
+
+#-------------------------------------------------------------------------------
+# Download the orders for the date range last selected on the Orders screen as
+# a CSV file. The rows are streamed from the database, not held in memory.
+#-------------------------------------------------------------------------------
+
+@app.route('/exportorders')
+@login_required
+def exportorders():
+
+    dates = ds.store.get('orderdates', [])
+    if not dates:
+        return redirect(url_for('orders', page='f'))
+
+    rows = db.iterOrders(dates[0], dates[1])
+    disp = f'attachment; filename=orders_{dates[0]}_{dates[1]}.csv'
+    return Response(stream_with_context(db.csvStream(rows)),
+                    mimetype='text/csv', headers={'Content-Disposition': disp})
 
 #-------------------------------------------------------------------------------
 # Route to page for testing Weather API call
@@ -234,32 +261,44 @@ def api():
     ret = db.getLatLon(ds.store.get('data',[]))[0]
     lat = ret[0]
     lon = ret[1]
-    key = app.config["API_KEY"]
-    url1 = app.config["API_URL1"]   # current weather conditions
-    url2 = app.config['API_URL2']   # astronomy data (sun, moon)
-
-    # Assemble the complete API request url
-    apiReq1 = url1 + '?key=' + key + '&q=' + lat + ',' + lon + '&aqi=yes'
-    apiReq2 = url2 + '?key=' + key + '&q=' + lat + ',' + lon
 
-    # Call the Weather API site
+    # Get the current conditions and astronomy data (sun, moon) - from the
+    # cache if they have been fetched recently, otherwise from the Weather
+    # API site (both calls at once).
     try:
-        response = requests.get(apiReq1)
-        response.raise_for_status()
-        data1 = response.json()
-        response = requests.get(apiReq2)
-        response.raise_for_status()
-        data2 = response.json()
+        data = wc.get(lat, lon)
     except requests.exceptions.HTTPError as http_err:
         return jsonify({'error': f'HTTP error occurred: {http_err}'}), 500
     except Exception as err:
         return jsonify({'error': f'Other error occurred: {err}'}), 500
 
-    # Concatenate the returned data and store in session
-    ds.store['data'] = dict(data2, **data1)
+    # The combined data is stored in session
+    ds.store['data'] = data
 
     return redirect(url_for('weather', orig='api'))
 
+#-------------------------------------------------------------------------------
+# Route for the weather history of a location (hourly or daily averages), as
+# JSON - one list for each value, e.g. {"Time": [...], "TempC": [...], ...}
+#-------------------------------------------------------------------------------
+
+@app.route('/weatherhistory/<location>/<bucket>')
+@login_required
+def weatherhistory(location, bucket):
+
+    if bucket not in ('hour', 'day'):
+        return jsonify({'error': 'The period must be hour or day'}), 400
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    series = db.getWeatherSeries(location, bucket, start, end)
+    if isinstance(series, str):
+        return jsonify({'error': series}), 500
+
+    # NaN (no readings) isn't valid JSON, so send null
+    return jsonify({name: [None if value != value else value
+                           for value in values.tolist()]
+                    for name, values in series.items()})
+
 #-------------------------------------------------------------------------------
 # Route for the 'Send Email' navbar option.
 #-------------------------------------------------------------------------------
@@ -312,7 +351,7 @@ def email():
 @login_required
 def browsedb(name, option):
 
-    dbase = app.config['DATABASE']
+    dbase = os.path.basename(app.config['DATABASE'])
 
     if request.method == 'POST':
         rad = request.form.get("radSchema")
@@ -328,16 +367,53 @@ def browsedb(name, option):
         ds.store['rowdata'] = []
         ds.store['viewdef'] = ''
 
+    page = None
     if name != 'none':
-        res, viewDef = db.getTableDets(name, option)
+        # Paging through the rows : after/before hold the key of the last/first
+        # row of the current page (as JSON), key is a value to jump to.
+        args = {}
+        for arg in ('after', 'before'):
+            try:
+                key = json.loads(request.args[arg])
+            except (KeyError, ValueError):
+                continue
+            if isinstance(key, list) and key:
+                args[arg] = key
+        if request.args.get('key'):
+            args['start'] = request.args['key']
+        args['last'] = request.args.get('last') == 'y'
+
+        res, viewDef, page = db.getTableDets(name, option, **args)
         ds.store['rowdata'] = res
         ds.store['viewdef'] = viewDef
+        if page:
+            page['first'] = json.dumps(page['first'])
+            page['last'] = json.dumps(page['last'])
 
     return render_template('browsedb.html', title='Database Schema', year=year,
                             database=dbase, schema=ds.store.get('schema', []),
                             rad=ds.store.get('radio', ''),
                             table=ds.store.get('rowdata',[]),
-                            view=ds.store.get('viewdef',''))
+                            view=ds.store.get('viewdef',''),
+                            name=name, option=option, page=page)
+
+#-------------------------------------------------------------------------------
+# Download the full contents of a database table or view as a CSV file. The
+# rows are streamed from the database, not held in memory.
+#-------------------------------------------------------------------------------
+
+@app.route('/exporttable/<name>')
+@login_required
+def exporttable(name):
+
+    # Check the name before the response (and its headers) is started
+    name = db.exportName(name)
+    if name is None:
+        abort(404)
+    rows = db.iterTableData(name)
+    disp = f'attachment; filename={name}.csv'
+    return Response(stream_with_context(db.csvStream(rows)),
+                    mimetype='text/csv', headers={'Content-Disposition': disp})
 
 #-------------------------------------------------------------------------------
 # Route for the image browser page.
@@ -348,9 +424,6 @@ def browsedb(name, option):
 def browseimages():
 
     folder = app.config['PHOTO_DIR']
-    if not ds.store.get('thumbs', None):
-        thumbs = db.getImageDetails()
-        ds.store['thumbs'] = thumbs
 
     images = []
     form = ImageBrowseForm()
@@ -361,13 +434,17 @@ def browseimages():
                 file.save(folder + file_filename)
                 images.append(folder + file_filename)
             ret = db.storeNewImages(images, '640')
-            thumbs = db.getImageDetails()
-            ds.store['thumbs'] = thumbs
+
+    # Only the page of images being shown is read from the database. The
+    # page is 'f'irst, 'n'ext, 'p'revious, 'l'ast or (by default) 'c'urrent.
+    thumbs, ds.store['dictImages'] = db.imagePages.page(
+                                ds.store.get('dictImages'),
+                                request.args.get('page', 'c'))
 
     return render_template('browseimages.html', title='Image Browser',
-                            year=year, form=form,
-                            thumbs=ds.store.get('thumbs', []),
-                            total = len(ds.store.get('thumbs', [])))
+                            year=year, form=form, thumbs=thumbs,
+                            total=ds.store['dictImages'].get('size', 0),
+                            cursor=ds.store['dictImages'])
 
 #-------------------------------------------------------------------------------
 # Route for image edit.
@@ -407,8 +484,6 @@ def editimage(image):
                 thumb = newName.replace('.', '_thumb.')
                 os.rename(image, thumb)
 
-            thumbs = db.getImageDetails()
-            ds.store['thumbs'] = thumbs
             msg = 'Requested changes have been applied'
 
         flash(msg)
@@ -437,8 +512,6 @@ def deleteimage(image):
                 os.remove(image)
 
             db.deleteImage(image)
-            thumbs = db.getImageDetails()
-            ds.store['thumbs'] = thumbs
 
             msg = f'Image {image.replace("_thumb","")} was deleted'
 
@@ -495,37 +568,13 @@ def setbackground(image):
 @login_required
 def music(track, delete, page):
 
-    rows = 10
-    if not ds.store.get('dictMusic', {}):
-        ds.store['dictMusic'] = {'page':page, 'count':rows, 'size':0}
-
-    ds.store['dictMusic']['page'] = page
-
-    # Calculate the end index for the list slicing
-    if page == 'f': ds.store['dictMusic']['count'] = rows
-    elif page == 'n': ds.store['dictMusic']['count'] += rows
-    elif page == 'p': ds.store['dictMusic']['count'] -= rows
-    elif page == 'l':  ds.store['dictMusic']['count'] = ds.store['dictMusic']['size']
-
-    # Check for, and correct, out-of-range values
-    if ds.store['dictMusic']['count'] < rows :
-        ds.store['dictMusic']['count'] = rows
-    if (ds.store['dictMusic']['count'] > ds.store['dictMusic']['size'] and
-        ds.store['dictMusic']['size'] != 0):
-        ds.store['dictMusic']['count'] = ds.store['dictMusic']['size']
-
     folder = app.config['MUSIC_DIR']
-    if not ds.store.get('musicdata', []):
-        ds.store['musicdata'] = db.getAudio()
-        ds.store['dictMusic']['size'] = len(ds.store['musicdata'])
 
     if delete == 'yes':
         ret = db.deleteAudio(track)
         if os.path.isfile(track):
             os.remove(track)
         play = 'none'
-        ds.store['musicdata'] = db.getAudio()
-        ds.store['dictMusic']['size'] = len(ds.store['musicdata'])
     else:
         play = track
 
@@ -538,19 +587,18 @@ def music(track, delete, page):
                 file.save(folder + file_filename)
                 tracks.append(folder + file_filename)
             ret = db.storeAudio(tracks)
-            ret = db.getAudio()
-            ds.store['musicdata'] = ret
-            ds.store['dictMusic']['size'] = len(ds.store['musicdata'])
 
     nameOnly = os.path.basename(track).replace('_', ' ').replace('.mp3', '')
 
-    count = ds.store['dictMusic']['count']
-    ds.store['pageTracks'] = ds.store['musicdata'][count-rows:count]
+    # Only the page of tracks being shown is read from the database. Playing
+    # or deleting a track shows the 'c'urrent page again.
+    pageTracks, ds.store['dictMusic'] = db.musicPages.page(
+                                ds.store.get('dictMusic'), page)
 
     return render_template('music.html', title='Music Player', form=form,
-                           tracks=ds.store.get('pageTracks',[]),
-                           play=play, trackname=nameOnly,
-                           page=page, year=year)
+                           tracks=pageTracks, play=play, trackname=nameOnly,
+                           page=page, year=year,
+                           cursor=ds.store['dictMusic'])
 
 #-------------------------------------------------------------------------------
 # Route for the video player page.
@@ -702,17 +750,25 @@ def admin(delete, user):
         session.pop(key)
 
     if delete == 'yes':
-        ds.clearStore()
+        ds.clearStore(allSessions=True)
+        return redirect(url_for('admin', delete='no', user='none'))
+    if delete == 'stats':
+        db.resetQueryStats()
         return redirect(url_for('admin', delete='no', user='none'))
     if user != 'none':
         db.updateUserAuth(user)
         return redirect(url_for('admin', delete='no', user='none'))
 
-    res = ds.storeContents()
+    summary, res = ds.storeContents()
     users = db.getAllUsers()
+    profile, settings = db.getDbSettings()
+    queries, slowlog = db.getQueryStats()
 
     return render_template('admin.html', title='Administration', store=res,
-                            sessvar=sessVar, users=users, year=year)
+                            summary=summary, sessvar=sessVar, users=users, year=year,
+                            profile=profile, settings=settings,
+                            queries=queries, slowlog=slowlog,
+                            cache=db.getCacheStats())
 
 #-------------------------------------------------------------------------------
 # Route to the user registration page.
@@ -0,0 +1,393 @@
+"""
+ Name:          weather.py
+
+ Purpose:       Cache for the Weather API site. The results are held for each
+                location (latitude, longitude) - the current conditions for a
+                few minutes, and the astronomy data (sunrise, moon phase etc.)
+                for some hours, as they change much more slowly.
+
+                An entry past its time to live is still returned, and a
+                refresh started in the background, so a user only waits for
+                the API when the location hasn't been fetched before (or not
+                for a long time). When both calls are needed they are made
+                at the same time, from a small pool of threads.
+
+                The Prefetcher keeps the cache warm for every location in the
+                Location table, refreshing each one in a background thread
+                shortly before it expires, spread over the interval and kept
+                within a limit on the number of calls per minute.
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# The two parts of the data, and the API url config setting for each
+PARTS = {'current': 'API_URL1', 'astronomy': 'API_URL2'}
+# API_KEY values meaning that no key has been set (config.py's default)
+NO_KEY = ('', 'my api key')
+
+#-------------------------------------------------------------------------------
+
+class WeatherCache():
+    """ The API results for each location. Pass the Flask app (or call
+        initApp) to read the settings from its config :
+            API_KEY, API_URL1, API_URL2 - the Weather API site details
+            WEATHER_CURRENT_TTL  - seconds the current conditions are fresh
+            WEATHER_ASTRO_TTL    - seconds the astronomy data is fresh
+            WEATHER_STALE_SECONDS - older entries are fetched again before
+                                   being returned, not in the background
+            WEATHER_TIMEOUT      - seconds to wait for the API site
+            WEATHER_WORKERS      - threads for the API calls
+        'onFetch', if set, is called as onFetch(lat, lon, part, data) after
+        each successful API call (e.g. to keep a history).
+    """
+
+    def __init__(self, app=None):
+
+        self.key = ''
+        self.urls = {}
+        self.ttl = {'current': 600, 'astronomy': 6 * 3600}
+        self.staleSeconds = 24 * 3600
+        self.timeout = 10
+        self.workers = 4
+        self.hits = 0               # parts returned fresh from the cache
+        self.stale = 0              # returned stale, and refreshed
+        self.misses = 0             # fetched while the user waited
+        self.errors = 0             # failed background refreshes
+        self.onFetch = None
+        self.__entries = {}         # (lat, lon, part) : [data, fetched time]
+        self.__pending = set()      # (lat, lon, part) being refreshed
+        self.__lock = threading.Lock()
+        self.__poolLock = threading.Lock()
+        self.__local = threading.local()
+        self.__pool = None
+        if app is not None:
+            self.initApp(app)
+
+#-------------------------------------------------------------------------------
+
+    def initApp(self, app):
+        """ Read the settings from the app config. """
+
+        self.key = app.config.get('API_KEY', '')
+        self.urls = {part: app.config.get(name) for part, name in PARTS.items()}
+        self.ttl['current'] = app.config.get('WEATHER_CURRENT_TTL',
+                                             self.ttl['current'])
+        self.ttl['astronomy'] = app.config.get('WEATHER_ASTRO_TTL',
+                                               self.ttl['astronomy'])
+        self.staleSeconds = app.config.get('WEATHER_STALE_SECONDS',
+                                           self.staleSeconds)
+        self.timeout = app.config.get('WEATHER_TIMEOUT', self.timeout)
+        self.workers = app.config.get('WEATHER_WORKERS', self.workers)
+
+#-------------------------------------------------------------------------------
+
+    @property
+    def pool(self):
+        """ The threads used for the API calls, started on first use. """
+
+        with self.__poolLock:
+            if self.__pool is None:
+                self.__pool = ThreadPoolExecutor(self.workers,
+                                                 thread_name_prefix='weather')
+            return self.__pool
+
+#-------------------------------------------------------------------------------
+
+    def get(self, lat, lon):
+        """ Return the API data for the location - the current conditions and
+            astronomy results in one dictionary, as the API site returns them.
+            Raises the requests exception if a call has to be made and
+            fails. """
+
+        now = time.time()
+        found, missing = {}, []
+        with self.__lock:
+            for part in PARTS:
+                entry = self.__entries.get((lat, lon, part))
+                age = now - entry[1] if entry else None
+                if entry is None or age > self.staleSeconds:
+                    missing.append(part)
+                    self.misses += 1
+                    continue
+                found[part] = entry[0]
+                if age > self.ttl[part]:
+                    self.stale += 1
+                    self.__refreshLater(lat, lon, part)
+                else:
+                    self.hits += 1
+
+        # Make any calls needed now at the same time, and wait for them all
+        futures = [self.pool.submit(self.refresh, lat, lon, part)
+                   for part in missing]
+        for part, future in zip(missing, futures):
+            found[part] = future.result()
+
+        return dict(found['astronomy'], **found['current'])
+
+#-------------------------------------------------------------------------------
+
+    def refresh(self, lat, lon, part):
+        """ Call the API site for one part of a location's data, store the
+            result and return it. """
+
+        url = self.urls[part] + '?key=' + self.key + '&q=' + lat + ',' + lon
+        if part == 'current':
+            url += '&aqi=yes'
+
+        response = self.__session().get(url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        with self.__lock:
+            self.__entries[(lat, lon, part)] = [data, time.time()]
+        if self.onFetch is not None:
+            self.onFetch(lat, lon, part, data)
+        return data
+
+#-------------------------------------------------------------------------------
+
+    def age(self, lat, lon, part):
+        """ Return the seconds since one part of a location's data was
+            fetched, or None if it hasn't been. """
+
+        with self.__lock:
+            entry = self.__entries.get((lat, lon, part))
+        return None if entry is None else time.time() - entry[1]
+
+#-------------------------------------------------------------------------------
+
+    def stats(self):
+        """ Return the counts of hits etc. (a dictionary). """
+
+        with self.__lock:
+            return {'entries': len(self.__entries), 'hits': self.hits,
+                    'stale': self.stale, 'misses': self.misses,
+                    'errors': self.errors}
+
+#-------------------------------------------------------------------------------
+
+    def clear(self):
+        """ Remove every entry. """
+
+        with self.__lock:
+            self.__entries.clear()
+
+#-------------------------------------------------------------------------------
+
+    def __refreshLater(self, lat, lon, part):
+        """ Start a background refresh of one part of a location's data,
+            unless there's one running already. Called with the lock held. """
+
+        key = (lat, lon, part)
+        if key in self.__pending:
+            return
+        self.__pending.add(key)
+        self.pool.submit(self.__backgroundRefresh, key)
+
+#-------------------------------------------------------------------------------
+
+    def __backgroundRefresh(self, key):
+        """ Refresh an entry, keeping the old data if the call fails. """
+
+        try:
+            self.refresh(*key)
+        except Exception as err:
+            print(f'Weather refresh failed for {key} : {err}')
+            with self.__lock:
+                self.errors += 1
+        finally:
+            with self.__lock:
+                self.__pending.discard(key)
+
+#-------------------------------------------------------------------------------
+
+    def __session(self):
+        """ A requests Session for this thread, so that the connection to the
+            API site is kept open between calls. """
+
+        sess = getattr(self.__local, 'session', None)
+        if sess is None:
+            sess = requests.Session()
+            self.__local.session = sess
+        return sess
+
+#-------------------------------------------------------------------------------
+
+class Prefetcher():
+    """ Refreshes a WeatherCache for a list of locations in a background
+        thread. 'locations' is called at the start of each round, and returns
+        rows of [name, latitude, longitude]. Pass the Flask app (or call
+        initApp) to read the settings from its config, and start the thread
+        when the app gets its first request :
+            WEATHER_PREFETCH_INTERVAL - seconds between rounds (0 = off)
+            WEATHER_RATE_LIMIT        - max. API calls a minute
+            WEATHER_JITTER            - fraction of the interval (0 to 1) by
+                                        which each round start is varied
+    """
+
+    def __init__(self, cache, locations, app=None):
+
+        self.cache = cache
+        self.locations = locations
+        self.interval = 900
+        self.rateLimit = 60
+        self.jitter = 0.1
+        self.rounds = 0             # completed rounds
+        self.calls = 0              # API calls made
+        self.failed = 0             # API calls that failed
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__requested = False
+        if app is not None:
+            self.initApp(app)
+
+#-------------------------------------------------------------------------------
+
+    def initApp(self, app):
+        """ Read the settings from the app config, and register the hook that
+            starts the thread on the first request. """
+
+        self.interval = app.config.get('WEATHER_PREFETCH_INTERVAL',
+                                       self.interval)
+        self.rateLimit = app.config.get('WEATHER_RATE_LIMIT', self.rateLimit)
+        self.jitter = app.config.get('WEATHER_JITTER', self.jitter)
+        app.before_request(self.__firstRequest)
+
+#-------------------------------------------------------------------------------
+
+    def start(self):
+        """ Start the background thread - unless the interval is 0, or no
+            API key has been set. Return True if it is running. """
+
+        with self.__lock:
+            if self.__thread is not None:
+                return True
+            if self.interval <= 0 or self.cache.key in NO_KEY:
+                return False
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, daemon=True,
+                                             name='weather-prefetch')
+            self.__thread.start()
+            return True
+
+#-------------------------------------------------------------------------------
+
+    def stop(self):
+        """ Stop the background thread, after any call in progress. """
+
+        self.__stop.set()
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is not None:
+            thread.join()
+
+#-------------------------------------------------------------------------------
+
+    def __firstRequest(self):
+        """ before_request hook - start the thread on the app's first request,
+            so that just importing the app makes no API calls. """
+
+        if not self.__requested:
+            self.__requested = True
+            self.start()
+
+#-------------------------------------------------------------------------------
+
+    def due(self):
+        """ Return the (lat, lon, part) of every entry that is missing or will
+            expire before the next round. """
+
+        res = []
+        for row in self.locations():
+            lat, lon = str(row[1]), str(row[2])
+            for part in PARTS:
+                age = self.cache.age(lat, lon, part)
+                if age is None or age + self.interval >= self.cache.ttl[part]:
+                    res.append((lat, lon, part))
+        return res
+
+#-------------------------------------------------------------------------------
+
+    def runOnce(self):
+        """ Refresh every entry that is due, using the cache's thread pool,
+            spacing the calls to stay within the rate limit. Return the number
+            of calls that failed. """
+
+        gap = 60 / self.rateLimit if self.rateLimit > 0 else 0
+        futures = []
+        for key in self.due():
+            if self.__stop.is_set():
+                break
+            futures.append(self.cache.pool.submit(self.cache.refresh, *key))
+            self.__stop.wait(gap)
+
+        failed = 0
+        for future in futures:
+            if future.exception() is not None:
+                failed += 1
+        self.calls += len(futures)
+        self.failed += failed
+        self.rounds += 1
+        return failed
+
+#-------------------------------------------------------------------------------
+
+    def __run(self):
+        """ The background thread - a round every 'interval' seconds (varied by
+            up to 'jitter' of it), the first after a short random delay so that
+            several server processes don't all start at once. """
+
+        wait = random.uniform(0, min(self.interval * self.jitter, 30))
+        while not self.__stop.wait(wait):
+            start = time.time()
+            try:
+                failed = self.runOnce()
+                if failed:
+                    print(f'Weather prefetch : {failed} calls failed')
+            except Exception as err:
+                print(f'Weather prefetch failed : {err}')
+            spread = self.interval * self.jitter
+            wait = max(self.interval + random.uniform(-spread, spread)
+                       - (time.time() - start), 1)
+
+#-------------------------------------------------------------------------------
+
+def main():
+    """ Test code """
+
+    from orders_app import app
+
+    wc = WeatherCache(app)
+    for _ in range(2):
+        start = time.perf_counter()
+        try:
+            data = wc.get('51.5', '-0.12')
+            print(data['location']['name'], data['current']['temp_c'])
+        except Exception as err:
+            print(err)
+        print(f'\t{round((time.perf_counter() - start) * 1000)} ms')
+    print(wc.stats())
+
+    return
+
+    #return
+    from subprocess import Popen
+    Popen('pdoc weather.py -o ./docs')
+    print('HTML docs produced for this module')
+
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
+#-------------------------------------------------------------------------------
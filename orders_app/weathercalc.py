@@ -0,0 +1,122 @@
+"""
+ Name:          weathercalc.py
+
+ Purpose:       Calculations on the Weather API data : the day length from the
+                sunrise and sunset times, and the wet bulb temperature. Each
+                has a version for whole NumPy arrays of readings (for the
+                weather history), and one for a single reading, which is a
+                thin wrapper round the array version so that both always
+                give the same results.
+
+                This module only needs NumPy - it doesn't load the website -
+                so it can be used (and timed, see benchmark.py) on its own.
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+import numpy as np
+
+#-------------------------------------------------------------------------------
+
+def getDayLength(start, end):
+    """ Calculate the interval between the provided start and end times, as a
+        decimal hour value. They will be strings in the format '09:35 PM' """
+
+    hours = dayLengthArray([start], [end])[0]
+
+    return str(round(float(hours), 2))
+
+#-------------------------------------------------------------------------------
+
+def clockSeconds(times):
+    """ Return an array of the seconds since midnight for an array of times
+        in the format '09:35 PM' (the hour may be 1 digit, and the space and
+        upper case are optional). The characters are worked on as an array of
+        code points, one row per time, so there's no Python loop. """
+
+    times = np.asarray(times, dtype=str)
+    if times.size == 0:
+        return np.zeros(0, dtype=int)
+    chars = times.view(np.uint32).reshape(len(times), -1).astype(int)
+    chars = np.pad(chars, ((0, 0), (0, 3)))     # room for 'h:mm' if too short
+    rows = np.arange(len(times))
+
+    # The digits either side of the ':'
+    colon = np.argmax(chars == ord(':'), axis=1)
+    digits = chars - ord('0')
+    used = np.stack([digits[:, 0], np.where(colon == 2, digits[:, 1], 0),
+                     digits[rows, colon + 1], digits[rows, colon + 2]])
+    hour = np.where(colon == 2, used[0] * 10 + used[1], used[0])
+    minute = used[2] * 10 + used[3]
+    pm = np.any((chars == ord('P')) | (chars == ord('p')), axis=1)
+    if ((colon < 1) | (colon > 2)).any() or (used < 0).any() or \
+            (used > 9).any() or hour.max() > 12 or minute.max() > 59:
+        raise ValueError('Times must be in the format 09:35 PM')
+
+    # 12:xx AM is hour 0, 12:xx PM is hour 12
+    hour = hour % 12 + np.where(pm, 12, 0)
+    return hour * 3600 + minute * 60
+
+#-------------------------------------------------------------------------------
+
+def dayLengthArray(start, end):
+    """ getDayLength for arrays of start and end times. Return an array of
+        the intervals in hours, not rounded. An end time before the start
+        time is taken to be on the next day. """
+
+    return ((clockSeconds(end) - clockSeconds(start)) % 86400) / 3600
+
+#-------------------------------------------------------------------------------
+
+def calcWetBulb(tempC, humidity):
+    """ Calculate the wet bulb temperature in both centigrade and farenheit.
+        Return the values rounded to 2 decimal places. Input parameters
+        are float values. """
+
+    wetbulbC, wetbulbF = wetBulbArray(tempC, humidity)
+
+    # First is Centigrade, second is Farenheit
+    return str(round(float(wetbulbC), 2)), str(round(float(wetbulbF), 2))
+
+#-------------------------------------------------------------------------------
+
+def wetBulbArray(tempC, humidity):
+    """ calcWetBulb for arrays of temperatures (C) and relative humidities.
+        Return arrays of the wet bulb temperatures in centigrade and
+        farenheit, not rounded. """
+
+    tempC = np.asarray(tempC, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+
+    a = tempC * np.arctan(0.151977 * (humidity + 8.313659) ** 0.5)
+    b = np.arctan(tempC + humidity) - np.arctan(humidity - 1.676331)
+    c = 0.00391838 * humidity ** (1.5) * np.arctan(0.023101 * humidity)
+    d = -4.686035
+    wetbulbC = a + b + c + d
+
+    return wetbulbC, wetbulbC * 1.8 + 32
+
+#-------------------------------------------------------------------------------
+
+def main():
+    """ Test code """
+
+    print(getDayLength('07:24 AM', '06:12 PM'))
+    print(calcWetBulb(12.5, 80))
+    print(dayLengthArray(['07:24 AM', '11:50 PM'], ['06:12 PM', '12:10 AM']))
+
+    return
+
+    #return
+    from subprocess import Popen
+    Popen('pdoc weathercalc.py -o ./docs')
+    print('HTML docs produced for this module')
+
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
+#-------------------------------------------------------------------------------
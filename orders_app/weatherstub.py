@@ -0,0 +1,162 @@
+"""
+ Name:          weatherstub.py
+
+ Purpose:       A local stand-in for the Weather API site, for testing
+                without an api key or network access (and without using up
+                the call allowance). It answers current.json and
+                astronomy.json requests with made-up data in the same format
+                as the real site, varying with the location and the time.
+
+                Run it (python weatherstub.py [port]) and start the website
+                with WEATHER_API_BASE=http://127.0.0.1:8765/v1, or call start()
+                from test code. WEATHER_API_BASE must be set before the app is
+                imported (which importing this module from the package does),
+                or the WeatherCache given the urls with initApp. The stub
+                accepts any key, but the Prefetcher only runs with one set
+                (WEATHER_API_KEY).
+
+ Author:        Bill
+
+ Created:       17/10/2026
+
+"""
+#-------------------------------------------------------------------------------
+
+import json
+import math
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+#-------------------------------------------------------------------------------
+
+def current(lat, lon, now):
+    """ Return a current.json result for the location. """
+
+    # A daily temperature cycle, offset by the location
+    hour = (now % 86400) / 3600
+    tempC = round(10 + 6 * math.sin((hour - 9) / 24 * 2 * math.pi)
+                  + (55 - lat) / 2, 1)
+    humidity = int(70 + 20 * math.cos(hour / 24 * 2 * math.pi))
+    windKph = round(10 + abs(lon) * 3, 1)
+
+    return {'location': {'name': f'Stub {lat},{lon}', 'region': 'Stub Region',
+                         'country': 'United Kingdom', 'tz_id': 'Europe/London',
+                         'lat': lat, 'lon': lon},
+            'current': {'last_updated_epoch': int(now),
+                        'temp_c': tempC, 'temp_f': round(tempC * 1.8 + 32, 1),
+                        'feelslike_c': tempC - 1,
+                        'feelslike_f': round((tempC - 1) * 1.8 + 32, 1),
+                        'windchill_c': tempC - 2,
+                        'windchill_f': round((tempC - 2) * 1.8 + 32, 1),
+                        'dewpoint_c': tempC - 4,
+                        'dewpoint_f': round((tempC - 4) * 1.8 + 32, 1),
+                        'humidity': humidity, 'cloud': 50,
+                        'condition': {'text': 'Partly cloudy'},
+                        'pressure_mb': 1012.0, 'pressure_in': 29.88,
+                        'precip_mm': 0.1, 'precip_in': 0.0,
+                        'vis_km': 10.0, 'vis_miles': 6.0,
+                        'wind_dir': 'SW', 'wind_degree': 225,
+                        'wind_kph': windKph,
+                        'wind_mph': round(windKph / 1.609, 1),
+                        'gust_kph': round(windKph * 1.5, 1),
+                        'gust_mph': round(windKph * 1.5 / 1.609, 1),
+                        'uv': 3.0,
+                        'air_quality': {'co': 220.3, 'no2': 12.1, 'o3': 60.0,
+                                        'so2': 2.2, 'pm2_5': 5.5, 'pm10': 7.1,
+                                        'gb-defra-index': 1}}}
+
+#-------------------------------------------------------------------------------
+
+def astronomy(lat, lon, now):
+    """ Return an astronomy.json result for the location. """
+
+    return {'location': {'name': f'Stub {lat},{lon}', 'lat': lat, 'lon': lon},
+            'astronomy': {'astro': {'sunrise': '07:24 AM',
+                                    'sunset': '06:12 PM',
+                                    'moonrise': '09:05 PM',
+                                    'moonset': '11:40 AM',
+                                    'moon_phase': 'Waning Gibbous',
+                                    'moon_illumination': 78}}}
+
+# The responses for each path
+RESULTS = {'/v1/current.json': current, '/v1/astronomy.json': astronomy}
+
+#-------------------------------------------------------------------------------
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answers GET requests for the paths in RESULTS. 'delay' is added to
+        every response, to act like the real site's latency. """
+
+    delay = 0.0
+    calls = 0
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        func = RESULTS.get(url.path)
+        try:
+            lat, lon = (float(value) for value in query['q'][0].split(','))
+        except (KeyError, ValueError):
+            func = None
+
+        type(self).calls += 1
+        time.sleep(self.delay)
+        if func is None:
+            self.send(400, {'error': {'code': 1006,
+                                      'message': 'No matching location found.'}})
+        else:
+            self.send(200, func(lat, lon, time.time()))
+
+    def send(self, status, result):
+
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+#-------------------------------------------------------------------------------
+
+def start(port=0, delay=0.0):
+    """ Start the stub server in a background thread, on the port given (0 =
+        any free port). Return the server (call shutdown() to stop it) and
+        the base url to use as WEATHER_API_BASE. """
+
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/v1'
+
+#-------------------------------------------------------------------------------
+
+def main():
+    """ Run the stub server until interrupted. """
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    print(f'Weather API stub on http://127.0.0.1:{port}/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+    return
+
+    #return
+    from subprocess import Popen
+    Popen('pdoc weatherstub.py -o ./docs')
+    print('HTML docs produced for this module')
+
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
+#-------------------------------------------------------------------------------